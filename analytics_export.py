@@ -0,0 +1,283 @@
+"""
+Incremental analytics export of delivered verdicts.
+
+    python -m analytics_export --source jsonl --verdicts verdicts.jsonl --out analytics
+    python -m analytics_export --source postgres --out analytics
+    python -m analytics_export --out analytics --summary
+
+Each run reads only verdicts past the checkpoint kept in <out>/_checkpoint.json
+(a timestamp for the JSONL log and its dated segments, the last row id for
+Postgres), extracts the win percentages and appends columnar files laid out as
+
+    <out>/date=YYYY-MM-DD/theme=<theme>/part-<run>-<n>.parquet
+
+Parquet needs pyarrow; without it the same columns are written as compressed
+NumPy archives (.npz). Part names are derived from the starting checkpoint,
+so a run that crashed before saving its checkpoint is simply overwritten by
+the next one. Records younger than SETTLE_S are left for the next run, which
+gives write-behind queues time to flush.
+"""
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+
+from case_store import iter_jsonl
+from compaction import verdict_segments
+from verdict_cache import is_error
+from verdict_parse import parse_percentages, winner_of
+
+SETTLE_S = float(os.getenv("ANALYTICS_SETTLE_S", "300"))
+BATCH_ROWS = int(os.getenv("ANALYTICS_BATCH_ROWS", "200000"))
+CHECKPOINT = "_checkpoint.json"
+
+COLUMNS = ("timestamp", "token", "lang", "user1_pct", "user2_pct", "winner", "verdict_chars")
+_SEGMENT_DAY = re.compile(r"\.(\d{4}-\d{2}-\d{2})\.[^.]+$")
+
+
+# ---------- Rows ----------
+def to_row(timestamp: datetime, rec: dict) -> dict:
+    if rec.get("user1_pct") is not None and rec.get("user2_pct") is not None:
+        pct = (rec["user1_pct"], rec["user2_pct"])  # stored structured fields
+    else:
+        pct = parse_percentages(rec.get("verdict") or "", rec.get("user1_name"), rec.get("user2_name"))
+    winner = rec.get("winner")
+    return {
+        "date": timestamp.date().isoformat(),
+        "theme": rec.get("theme") or "unknown",
+        "timestamp": timestamp,
+        "token": rec.get("token") or "",
+        "lang": rec.get("lang") or "",
+        "user1_pct": pct[0] if pct else float("nan"),
+        "user2_pct": pct[1] if pct else float("nan"),
+        "winner": winner if winner is not None else winner_of(pct),
+        "verdict_chars": len(rec.get("verdict") or ""),
+    }
+
+
+# ---------- Sources ----------
+def jsonl_rows(verdicts_path: str, since: str | None, until: datetime):
+    """Yield (watermark, row) for records with since < timestamp <= until."""
+    since_day = since[:10] if since else ""
+    # The active log first: rotation may move a record into a dated segment
+    # while we read, so it can show up twice but never goes missing.
+    paths = [verdicts_path] + [p for p in reversed(verdict_segments(verdicts_path)[:-1])
+                               if _SEGMENT_DAY.search(p).group(1) >= since_day]
+    seen = set()
+    for path in paths:
+        for rec in iter_jsonl(path):
+            ts = rec.get("timestamp")
+            if not ts or (since and ts <= since) or is_error(rec.get("verdict")):
+                continue
+            try:
+                when = datetime.fromisoformat(ts)
+            except ValueError:
+                continue
+            key = (ts, rec.get("token"), rec.get("cache_key"))
+            if when > until or key in seen:
+                continue
+            seen.add(key)
+            yield ts, to_row(when, rec)
+
+
+def postgres_rows(since: int | None, until: datetime):
+    import db  # psycopg2 is only needed for this source
+
+    conn = db.get_connection()
+    try:
+        with conn.cursor(name="analytics_export") as cur:  # server-side cursor: streams, O(batch) memory
+            cur.itersize = 10000
+            cur.execute(
+                "SELECT id, created_at, theme, user1_name, user2_name, verdict, lang, winner, user1_pct, user2_pct "
+                "FROM verdicts "
+                "WHERE id > %s ORDER BY id",
+                (since or 0,),
+            )
+            for row_id, created_at, theme, u1n, u2n, verdict, lang, winner, u1_pct, u2_pct in cur:
+                if created_at > until:
+                    break  # ids are handed out in insert order; the rest is too fresh
+                if is_error(verdict):
+                    continue
+                rec = {"theme": theme, "user1_name": u1n, "user2_name": u2n, "verdict": verdict,
+                       "lang": lang, "winner": winner, "user1_pct": u1_pct, "user2_pct": u2_pct}
+                yield row_id, to_row(created_at, rec)
+    finally:
+        conn.close()
+
+
+# ---------- Columnar output ----------
+def _have_pyarrow() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _partition_dir(out_dir: str, date: str, theme: str) -> str:
+    theme = re.sub(r"[^\w-]+", "_", theme).strip("_") or "unknown"
+    return os.path.join(out_dir, f"date={date}", f"theme={theme}")
+
+
+class PartitionWriter:
+    def __init__(self, out_dir: str, run_key: str, fmt: str):
+        self.out_dir = out_dir
+        self.run_key = run_key
+        self.fmt = fmt
+        self.buffers = {}   # (date, theme) -> {column: [values]}
+        self.parts = {}     # (date, theme) -> parts written so far
+        self.pending = 0
+        self.rows = 0
+
+    def add(self, row: dict):
+        key = (row["date"], row["theme"])
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self.buffers[key] = {c: [] for c in COLUMNS}
+        for c in COLUMNS:
+            buf[c].append(row[c])
+        self.pending += 1
+        self.rows += 1
+        if self.pending >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for (date, theme), buf in self.buffers.items():
+            n = self.parts.get((date, theme), 0)
+            self.parts[(date, theme)] = n + 1
+            directory = _partition_dir(self.out_dir, date, theme)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self.run_key}-{n}.{self.fmt}")
+            if self.fmt == "parquet":
+                _write_parquet(path, buf)
+            else:
+                _write_npz(path, buf)
+        self.buffers = {}
+        self.pending = 0
+
+
+def _write_parquet(path: str, buf: dict):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({
+        "timestamp": pa.array(buf["timestamp"], pa.timestamp("us")),
+        "token": pa.array(buf["token"], pa.string()),
+        "lang": pa.array(buf["lang"], pa.string()).dictionary_encode(),
+        "user1_pct": pa.array(buf["user1_pct"], pa.float32()),
+        "user2_pct": pa.array(buf["user2_pct"], pa.float32()),
+        "winner": pa.array(buf["winner"], pa.int8()),
+        "verdict_chars": pa.array(buf["verdict_chars"], pa.int32()),
+    })
+    pq.write_table(table, path, compression="zstd")
+
+
+def _write_npz(path: str, buf: dict):
+    import numpy as np
+
+    np.savez_compressed(
+        path,
+        timestamp=np.array(buf["timestamp"], dtype="datetime64[us]"),
+        token=np.array(buf["token"], dtype=str),
+        lang=np.array(buf["lang"], dtype=str),
+        user1_pct=np.array(buf["user1_pct"], dtype=np.float32),
+        user2_pct=np.array(buf["user2_pct"], dtype=np.float32),
+        winner=np.array(buf["winner"], dtype=np.int8),
+        verdict_chars=np.array(buf["verdict_chars"], dtype=np.int32),
+    )
+
+
+# ---------- Checkpoint ----------
+def load_checkpoint(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, CHECKPOINT), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(out_dir: str, checkpoint: dict):
+    fd, tmp = tempfile.mkstemp(prefix=".checkpoint-", dir=out_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, CHECKPOINT))
+
+
+# ---------- Export ----------
+def export(source: str, out_dir: str, verdicts_path: str = "verdicts.jsonl", fmt: str | None = None) -> int:
+    """Append everything past the checkpoint; returns the number of rows written."""
+    fmt = fmt or ("parquet" if _have_pyarrow() else "npz")
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = load_checkpoint(out_dir)
+    key = "postgres" if source == "postgres" else f"jsonl:{os.path.abspath(verdicts_path)}"
+    since = checkpoint.get(key)
+    until = datetime.utcnow() - timedelta(seconds=SETTLE_S)
+
+    run_key = hashlib.sha1(f"{key}|{since}".encode("utf-8")).hexdigest()[:12]
+    writer = PartitionWriter(out_dir, run_key, fmt)
+    rows = postgres_rows(since, until) if source == "postgres" else jsonl_rows(verdicts_path, since, until)
+    watermark = since
+    for mark, row in rows:
+        writer.add(row)
+        if watermark is None or mark > watermark:
+            watermark = mark
+    writer.flush()
+
+    if watermark != since:
+        checkpoint[key] = watermark
+        save_checkpoint(out_dir, checkpoint)
+    return writer.rows
+
+
+# ---------- Quick aggregate ----------
+def summarize(out_dir: str):
+    """Verdict count, mean user-1 share and user-1 win rate per theme."""
+    files = glob.glob(os.path.join(out_dir, "date=*", "theme=*", "part-*"))
+    if any(f.endswith(".parquet") for f in files):
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+
+        table = ds.dataset(out_dir, format="parquet", partitioning="hive").to_table(
+            columns=["theme", "user1_pct", "winner"])
+        table = table.append_column("user1_won", pc.cast(pc.equal(table["winner"], 1), "int8"))
+        stats = table.group_by("theme").aggregate(
+            [("winner", "count"), ("user1_pct", "mean"), ("user1_won", "mean")]).to_pylist()
+        for s in sorted(stats, key=lambda s: s["theme"]):
+            print(f"{s['theme']:<16} verdicts={s['winner_count']:<9} "
+                  f"user1 share={s['user1_pct_mean'] or float('nan'):6.2f}%  user1 wins={s['user1_won_mean']:.1%}")
+        return
+
+    import numpy as np
+
+    per_theme = {}
+    for path in files:
+        theme = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+        with np.load(path) as part:
+            per_theme.setdefault(theme, []).append((part["user1_pct"], part["winner"]))
+    for theme, parts in sorted(per_theme.items()):
+        pct = np.concatenate([p for p, _ in parts])
+        winner = np.concatenate([w for _, w in parts])
+        print(f"{theme:<16} verdicts={len(winner):<9} "
+              f"user1 share={np.nanmean(pct) if np.isfinite(pct).any() else float('nan'):6.2f}%  "
+              f"user1 wins={np.mean(winner == 1):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export verdicts to partitioned columnar files")
+    parser.add_argument("--source", choices=["jsonl", "postgres"], default="jsonl")
+    parser.add_argument("--verdicts", default="verdicts.jsonl", help="JSONL verdict log (jsonl source)")
+    parser.add_argument("--out", default="analytics")
+    parser.add_argument("--format", choices=["parquet", "npz"], default=None, help="default: parquet if pyarrow is installed")
+    parser.add_argument("--summary", action="store_true", help="print per-theme aggregates and exit")
+    args = parser.parse_args()
+
+    if args.summary:
+        summarize(args.out)
+        return
+    rows = export(args.source, args.out, args.verdicts, args.format)
+    print(f"Exported {rows} verdicts to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
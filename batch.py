@@ -0,0 +1,193 @@
+"""
+Headless batch adjudication of dispute files from partner platforms.
+
+    python -m batch disputes.jsonl --backend deepseek --concurrency 16
+    python -m batch disputes.csv --postgres
+
+Each row needs theme, user1_name, user2_name, user1_input and user2_input;
+id, token, emails and phones are optional. Cases go through the same Judge
+as the apps (cache, translation, prompt budget, structured output) on a
+bounded pool of async workers, and the provider's shared rate limiter keeps
+the pool within its limits. Verdicts are written to the verdicts log (and
+Postgres) through the write-behind queues. Finished case ids are appended to
+<file>.done once their verdicts are flushed, so an interrupted run resumes
+where it stopped; failed cases are not recorded and are retried next time.
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from case_store import append_bytes, iter_jsonl
+from verdict_cache import is_error
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+CHECKPOINT_EVERY = int(os.getenv("BATCH_CHECKPOINT_EVERY", "50"))
+REQUIRED = ("theme", "user1_name", "user2_name", "user1_input", "user2_input")
+OPTIONAL = ("token", "user1_email", "user2_email", "user1_phone", "user2_phone")
+
+log = logging.getLogger(__name__)
+
+
+# ---------- Input ----------
+def read_cases(path: str):
+    """Rows of a .jsonl or .csv dispute file, streamed."""
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    else:
+        yield from iter_jsonl(path)
+
+
+def case_id(judge, row: dict) -> str:
+    """The partner's id, or the dispute key (same case, same id) when there is none."""
+    if row.get("id"):
+        return str(row["id"])
+    return judge.dispute_key(*(row[k] for k in ("user1_input", "user2_input", "theme", "user1_name", "user2_name")))
+
+
+def load_done(checkpoint_path: str) -> set:
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+# ---------- Batch ----------
+class Batch:
+    def __init__(self, judge, verdicts_path: str, checkpoint_path: str, to_postgres: bool = False, source: str = ""):
+        from write_behind import jsonl_writer, postgres_writer
+
+        self.judge = judge
+        self.checkpoint_path = checkpoint_path
+        self.source = source
+        self.writers = [jsonl_writer(verdicts_path)] + ([postgres_writer()] if to_postgres else [])
+        self.unsaved = []  # ids whose verdicts may still sit in the write-behind queues (event loop only)
+        self.stats = {"done": 0, "skipped": 0, "failed": 0}
+        self.started = time.monotonic()
+
+    def adjudicate(self, ident: str, row: dict) -> str | None:
+        """Runs on a worker thread; returns an error message or None."""
+        from verdict_parse import verdict_fields
+
+        missing = [k for k in REQUIRED if not row.get(k)]
+        if missing:
+            return f"missing {', '.join(missing)}"
+        args = tuple(row[k] for k in ("user1_input", "user2_input", "theme", "user1_name", "user2_name"))
+        result = self.judge.analyze(*args, structured=True)
+        if is_error(result["verdict"]):
+            return result["verdict"]
+        record = {
+            "timestamp": datetime.utcnow().isoformat(),
+            **{k: row.get(k) or None for k in OPTIONAL},
+            **{k: row[k] for k in REQUIRED},
+            "verdict": result["verdict"],
+            "lang": result["lang"],
+            "cache_key": self.judge.dispute_key(*args),
+            **verdict_fields(result),
+            "meta": {"batch": self.source, "case_id": ident},
+        }
+        for writer in self.writers:
+            writer.put(record)
+        return None
+
+    def checkpoint(self, ids: list) -> bool:
+        """Flush the verdicts, then record their ids as done (worker thread)."""
+        if not all([writer.flush(timeout=60) for writer in self.writers]):
+            return False
+        if ids:
+            append_bytes(self.checkpoint_path, "".join(f"{i}\n" for i in ids).encode("utf-8"), fsync=True)
+        return True
+
+    def progress(self) -> str:
+        elapsed = time.monotonic() - self.started
+        s = self.stats
+        return (f"{s['done']} done, {s['failed']} failed, {s['skipped']} already done "
+                f"in {elapsed:.1f}s ({s['done'] / elapsed if elapsed else 0:.1f}/s)")
+
+
+async def _run(batch: Batch, cases, concurrency: int, done: set):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency + 1, thread_name_prefix="batch"))
+    queue = asyncio.Queue(maxsize=concurrency * 2)  # bounded: the file is read as workers free up
+    checkpoint_lock = asyncio.Lock()
+
+    async def checkpoint():
+        async with checkpoint_lock:
+            ids, batch.unsaved = batch.unsaved, []
+            if not await asyncio.to_thread(batch.checkpoint, ids):
+                batch.unsaved = ids + batch.unsaved  # writers are behind; try again next time
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            ident, row = item
+            try:
+                error = await asyncio.to_thread(batch.adjudicate, ident, row)
+            except Exception as e:
+                error = str(e)
+            if error:
+                batch.stats["failed"] += 1
+                log.warning("Case %s failed: %s", ident, error)
+                continue
+            batch.stats["done"] += 1
+            batch.unsaved.append(ident)
+            if len(batch.unsaved) >= CHECKPOINT_EVERY:
+                await checkpoint()
+                log.info(batch.progress())
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    for position, row in enumerate(cases, start=1):
+        try:
+            ident = case_id(batch.judge, row)
+        except (KeyError, TypeError):
+            ident = f"row-{position}"  # stable across runs, so the checkpoint still matches
+        if ident in done:
+            batch.stats["skipped"] += 1
+            continue
+        done.add(ident)  # duplicate rows in the file are judged once
+        await queue.put((ident, row))
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+    await checkpoint()
+
+
+def run_batch(path: str, backend: str = "deepseek", verdicts_path: str = "verdicts.jsonl",
+              to_postgres: bool = False, concurrency: int = BATCH_CONCURRENCY,
+              checkpoint_path: str | None = None, api_key: str | None = None) -> dict:
+    """Adjudicate every case in `path` not yet in its checkpoint; returns the done/skipped/failed counts."""
+    from judge import Judge
+    from llm import make_backend
+
+    judge = Judge(make_backend(backend, api_key=api_key), verdicts_path)
+    checkpoint_path = checkpoint_path or f"{path}.done"
+    batch = Batch(judge, verdicts_path, checkpoint_path, to_postgres, source=os.path.basename(path))
+    asyncio.run(_run(batch, read_cases(path), max(1, concurrency), load_done(checkpoint_path)))
+    log.info(batch.progress())
+    return dict(batch.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adjudicate a JSONL/CSV file of disputes")
+    parser.add_argument("path", help="disputes file (.jsonl or .csv)")
+    parser.add_argument("--backend", default="deepseek")
+    parser.add_argument("--verdicts", default="verdicts.jsonl")
+    parser.add_argument("--postgres", action="store_true", help="also persist verdicts to Postgres")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--checkpoint", default=None, help="default: <path>.done")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    stats = run_batch(args.path, args.backend, args.verdicts, args.postgres, args.concurrency, args.checkpoint)
+    raise SystemExit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
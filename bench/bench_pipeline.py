@@ -0,0 +1,118 @@
+"""
+End-to-end Step-2 benchmark against the local chat-completions stub.
+
+    python -m bench.bench_pipeline --requests 200 --concurrency 1 8 32 --first-token-ms 300
+
+Each request runs what step_2 does: load_case, Judge.stream (language
+detection, prompt build, streamed LLM call through the real openai client
+pointed at bench.stub_llm), save_verdict through the write-behind queue, and
+optionally TTS (--tts, needs network for gTTS). Reports p50/p95/p99 for time
+to first token, full verdict, persistence and TTS.
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bench.stats import summarize
+from bench.stub_llm import StubConfig, start_stub
+from case_store import CaseStore
+from write_behind import WriteBehindQueue, jsonl_flusher
+
+
+def run(args, concurrency, base_url, workdir):
+    from judge import Judge
+    from llm import OpenAICompatBackend
+
+    pending = os.path.join(workdir, f"pending_c{concurrency}.jsonl")
+    verdicts = os.path.join(workdir, f"verdicts_c{concurrency}.jsonl")
+    store = CaseStore(pending)
+    writer = WriteBehindQueue(f"bench-{concurrency}", jsonl_flusher(verdicts, "interval"))
+    backend = OpenAICompatBackend("stub-http", "stub-key", base_url, "stub-model",
+                                  timeout=30.0, max_retries=0)
+    judge = Judge(backend, verdicts)
+
+    tokens = []
+    for i in range(args.requests):
+        token = uuid.uuid4().hex
+        tokens.append(token)
+        store.append({
+            "token": token, "theme": "Friends", "user1_name": "Alex", "user2_name": "Sam",
+            # unique text per request so the verdict cache never short-circuits
+            "user1_input": f"Case {i}: I lent Sam my car and it came back with a scratch.",
+            "created_at": datetime.utcnow().isoformat(),
+        })
+
+    timings = {"load_case": [], "first_token": [], "verdict": [], "save_verdict": [], "tts": [], "total": []}
+
+    def one(token):
+        t0 = time.perf_counter()
+        rec = store.get(token)
+        t1 = time.perf_counter()
+        chunks, lang = judge.stream(rec["user1_input"], "Sam says the scratch was already there.",
+                                    rec["theme"], rec["user1_name"], rec["user2_name"])
+        parts, first = [], None
+        for chunk in chunks:
+            if first is None:
+                first = time.perf_counter()
+            parts.append(chunk)
+        t2 = time.perf_counter()
+        verdict = "".join(parts)
+        writer.put({"token": token, "verdict": verdict, "lang": lang, "timestamp": datetime.utcnow().isoformat()})
+        t3 = time.perf_counter()
+        if args.tts:
+            from tts import synthesize
+
+            synthesize(verdict, lang)
+        t4 = time.perf_counter()
+        return t0, t1, first or t2, t2, t3, t4
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for t0, t1, first, t2, t3, t4 in pool.map(one, tokens):
+            timings["load_case"].append(t1 - t0)
+            timings["first_token"].append(first - t0)
+            timings["verdict"].append(t2 - t0)
+            timings["save_verdict"].append(t3 - t2)
+            if args.tts:
+                timings["tts"].append(t4 - t3)
+            timings["total"].append(t4 - t0)
+    writer.flush()
+    wall = time.perf_counter() - wall
+    writer.close()
+
+    print(f"\n== concurrency {concurrency}: {args.requests} requests in {wall:.2f}s "
+          f"({args.requests / wall:.1f} req/s)")
+    for name, samples in timings.items():
+        if samples:
+            print(summarize(name, samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step-1 -> Step-2 pipeline latency benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=15)
+    parser.add_argument("--base-url", default=None, help="use an already running stub instead of starting one")
+    parser.add_argument("--tts", action="store_true", help="include gTTS synthesis (needs network)")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_stub(0, StubConfig(args.first_token_ms / 1000, args.token_ms / 1000))
+    try:
+        with tempfile.TemporaryDirectory(prefix="ff-bench-") as workdir:
+            for concurrency in args.concurrency:
+                run(args, concurrency, base_url, workdir)
+    finally:
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
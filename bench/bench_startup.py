@@ -0,0 +1,110 @@
+"""
+Startup benchmark: cold import cost and, with Streamlit installed, first
+paint and per-rerun time of the app scripts.
+
+    python -m bench.bench_startup --runs 5
+    python -m bench.bench_startup --apps judgeit.py fairfight.py ff.py --reruns 20
+
+Every sample runs in a fresh interpreter so module caches start cold.
+"imports: eager" is what the scripts used to load at the top (gtts,
+langdetect, deep_translator, openai plus the helpers); "imports: lazy" is
+what Step 1 loads now. The helpers are the repo modules the apps import,
+read from their source so the list follows the apps. App runs use streamlit.testing's AppTest with the
+offline stub backend and no worker processes.
+"""
+import argparse
+import ast
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.stats import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ["gtts", "langdetect", "deep_translator", "openai"]
+
+IMPORT_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+print(json.dumps({"import": time.perf_counter() - t}))
+"""
+
+APP_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.secrets["openai"] = {"api_key": "bench"}
+t = time.perf_counter()
+at.run()
+first = time.perf_counter() - t
+reruns = []
+for _ in range(int(sys.argv[2])):
+    t = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - t)
+print(json.dumps({"first_paint": first, "reruns": reruns,
+                  "errors": [e.value for e in at.exception]}))
+"""
+
+
+def app_helpers(apps) -> list[str]:
+    """Repo modules imported at the top level of the app scripts."""
+    names = set()
+    for app in apps:
+        with open(os.path.join(ROOT, app), "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), app)
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.add(node.module.split(".")[0])
+    return sorted(n for n in names if os.path.exists(os.path.join(ROOT, f"{n}.py")))
+
+
+def probe(code, args, workdir):
+    env = dict(os.environ, PYTHONPATH=ROOT, LLM_BACKEND="stub", VERDICT_WORKERS="0", METRICS_PORT="")
+    out = subprocess.run([sys.executable, "-c", code, *args], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start and rerun benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--reruns", type=int, default=10, help="reruns per app after first paint")
+    parser.add_argument("--apps", nargs="*", default=["judgeit.py", "fairfight.py", "ff.py"])
+    args = parser.parse_args()
+
+    helpers = app_helpers(args.apps)
+    with tempfile.TemporaryDirectory(prefix="ff-bench-") as workdir:
+        print("== cold imports")
+        print("helpers:", ", ".join(helpers))
+        for label, modules in (("imports: eager", helpers + HEAVY), ("imports: lazy", helpers)):
+            samples = [probe(IMPORT_PROBE, modules, workdir)["import"] for _ in range(args.runs)]
+            print(summarize(label, samples))
+
+        if importlib.util.find_spec("streamlit") is None:
+            print("\nstreamlit is not installed: skipping first-paint and rerun timings")
+            return
+
+        for app in args.apps:
+            first, reruns = [], []
+            for _ in range(args.runs):
+                result = probe(APP_PROBE, [os.path.join(ROOT, app), str(args.reruns)], workdir)
+                if result["errors"]:
+                    print(f"{app}: {result['errors'][0]}")
+                first.append(result["first_paint"])
+                reruns.extend(result["reruns"])
+            print(f"\n== {app}")
+            print(summarize("first paint", first))
+            print(summarize("rerun", reruns))
+
+
+if __name__ == "__main__":
+    main()
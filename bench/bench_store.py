@@ -0,0 +1,174 @@
+"""
+Storage benchmark: pending-case lookups and appends as the JSONL files grow.
+
+    python -m bench.bench_store --sizes 10000 100000 1000000 --lookups 2000
+
+For each size a synthetic pending_cases.jsonl / verdicts.jsonl pair is
+generated in a temp directory, then we time: index migration (first open),
+load_case lookups (indexed store vs. the old linear scan on small sizes),
+save_case appends, verdict lookups by token and by cache key (the verdict
+cache's log tier), and write-behind verdict appends to the full log.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from bench.stats import summarize
+from case_store import CaseStore, iter_jsonl
+from verdict_cache import VerdictCache, verdict_for_token
+from write_behind import WriteBehindQueue, jsonl_flusher
+
+LINEAR_SCAN_MAX = 100_000  # the old O(n) scan is too slow to sample beyond this
+
+
+def synthetic_case(i):
+    return {
+        "theme": random.choice(["Couple", "Friends", "Pro"]),
+        "user1_name": f"Alex{i}", "user1_email": f"alex{i}@example.com", "user1_phone": f"+3361234{i:05d}",
+        "user2_name": f"Sam{i}", "user2_email": f"sam{i}@example.com", "user2_phone": f"+3369876{i:05d}",
+        "user1_input": "We agreed to split the rent but the payment was late again. " * 4,
+        "token": uuid.uuid4().hex,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+def generate(path, n):
+    tokens = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            rec = synthetic_case(i)
+            tokens.append(rec["token"])
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    return tokens
+
+
+def generate_verdicts(path, tokens):
+    """One verdict per case; returns the cache keys."""
+    keys = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i, token in enumerate(tokens):
+            key = uuid.uuid4().hex + uuid.uuid4().hex
+            keys.append(key)
+            f.write(json.dumps({
+                "timestamp": datetime.utcnow().isoformat(), "token": token, "theme": "Couple",
+                "user1_name": f"Alex{i}", "user2_name": f"Sam{i}",
+                "verdict": "Alex is more reasonable. 60% vs 40%", "lang": "en", "cache_key": key,
+                "winner": 1, "user1_pct": 60.0, "user2_pct": 40.0, "key_arguments": {"user1": [], "user2": []},
+            }, ensure_ascii=False) + "\n")
+    return keys
+
+
+def linear_load(path, token):
+    for rec in iter_jsonl(path):
+        if rec.get("token") == token:
+            return rec
+    return None
+
+
+def run(size, lookups, appends, workdir):
+    pending = os.path.join(workdir, f"pending_{size}.jsonl")
+    verdicts = os.path.join(workdir, f"verdicts_{size}.jsonl")
+
+    t = time.perf_counter()
+    tokens = generate(pending, size)
+    print(f"\n== {size:,} cases ({os.path.getsize(pending) / 1e6:.1f} MB, generated in {time.perf_counter() - t:.1f}s)")
+
+    store = CaseStore(pending)
+    t = time.perf_counter()
+    store.refresh()
+    print(f"{'index migration (first open)':<32} {time.perf_counter() - t:.3f}s")
+
+    store = CaseStore(pending)
+    t = time.perf_counter()
+    store.refresh()
+    print(f"{'index load (warm restart)':<32} {time.perf_counter() - t:.3f}s")
+
+    sample = random.sample(tokens, min(lookups, len(tokens)))
+    samples = []
+    for tok in sample:
+        t = time.perf_counter()
+        assert store.get(tok) is not None
+        samples.append(time.perf_counter() - t)
+    print(summarize("load_case (indexed)", samples))
+
+    if size <= LINEAR_SCAN_MAX:
+        samples = []
+        for tok in sample[:max(1, min(50, lookups))]:
+            t = time.perf_counter()
+            linear_load(pending, tok)
+            samples.append(time.perf_counter() - t)
+        print(summarize("load_case (linear scan, old)", samples))
+
+    samples = []
+    for i in range(appends):
+        rec = synthetic_case(size + i)
+        t = time.perf_counter()
+        store.append(rec)
+        samples.append(time.perf_counter() - t)
+    print(summarize("save_case append", samples))
+
+    t = time.perf_counter()
+    keys = generate_verdicts(verdicts, tokens)
+    print(f"{'verdict log':<32} {os.path.getsize(verdicts) / 1e6:.1f} MB, generated in {time.perf_counter() - t:.1f}s")
+    t = time.perf_counter()
+    verdict_for_token(verdicts, tokens[0])
+    VerdictCache(verdicts).get(keys[0])
+    print(f"{'verdict index migration':<32} {time.perf_counter() - t:.3f}s")
+
+    picks = random.sample(range(size), min(lookups, size))
+    samples = []
+    for i in picks:
+        t = time.perf_counter()
+        assert verdict_for_token(verdicts, tokens[i]) is not None
+        samples.append(time.perf_counter() - t)
+    print(summarize("verdict_for_token", samples))
+
+    cache = VerdictCache(verdicts)
+    for label in ("verdict cache (log tier)", "verdict cache (memory)"):
+        samples = []
+        for i in picks:
+            t = time.perf_counter()
+            assert cache.get(keys[i]) is not None
+            samples.append(time.perf_counter() - t)
+        print(summarize(label, samples))
+
+    writer = WriteBehindQueue("bench", jsonl_flusher(verdicts, "interval"))
+    samples = []
+    t0 = time.perf_counter()
+    for i in range(appends):
+        t = time.perf_counter()
+        writer.put({"token": tokens[i % len(tokens)], "verdict": "60% vs 40%", "timestamp": datetime.utcnow().isoformat()})
+        samples.append(time.perf_counter() - t)
+    writer.flush()
+    total = time.perf_counter() - t0
+    writer.close()
+    print(summarize("save_verdict enqueue", samples))
+    print(f"{'save_verdict throughput':<32} {appends / total:,.0f} records/s (incl. flush)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pending-case / verdict storage benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--appends", type=int, default=2000)
+    parser.add_argument("--workdir", default=None, help="keep generated files here instead of a temp dir")
+    args = parser.parse_args()
+
+    random.seed(0)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        for size in args.sizes:
+            run(size, args.lookups, args.appends, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="ff-bench-") as workdir:
+            for size in args.sizes:
+                run(size, args.lookups, args.appends, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import statistics
+
+# ---------- Latency summaries ----------
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(name, samples, unit="ms", scale=1000.0):
+    """One report line: count, mean, p50/p95/p99 and max."""
+    if not samples:
+        return f"{name:<32} (no samples)"
+    vals = [s * scale for s in samples]
+    return (
+        f"{name:<32} n={len(vals):<7} mean={statistics.fmean(vals):9.3f}{unit} "
+        f"p50={percentile(vals, 50):9.3f}{unit} p95={percentile(vals, 95):9.3f}{unit} "
+        f"p99={percentile(vals, 99):9.3f}{unit} max={max(vals):9.3f}{unit}"
+    )
@@ -0,0 +1,124 @@
+"""
+Local HTTP stub of the OpenAI/DeepSeek chat-completions API.
+
+    python -m bench.stub_llm --port 8099 --first-token-ms 300 --token-ms 15
+
+Point a backend at it with base_url="http://127.0.0.1:8099/v1". Supports
+POST /v1/chat/completions with and without "stream": true (SSE chunks).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VERDICT = (
+    "After weighing both accounts, JudgeBot finds that both parties have valid concerns. "
+    "The first party communicated earlier and more clearly, while the second party "
+    "raised a fair point about timing. Verdict: the first party is more reasonable. "
+    "Win percentage: 60% vs 40%."
+)
+
+
+class StubConfig:
+    def __init__(self, first_token_s=0.3, token_s=0.015, jitter=0.2, error_rate=0.0):
+        self.first_token_s = first_token_s
+        self.token_s = token_s
+        self.jitter = jitter          # +/- fraction applied to every delay
+        self.error_rate = error_rate  # fraction of requests answered with 429
+
+    def delay(self, base):
+        if base > 0:
+            time.sleep(base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+def _handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": "not found"}})
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if random.random() < config.error_rate:
+                return self._json(429, {"error": {"message": "rate limited (stub)", "type": "rate_limit"}})
+
+            model = request.get("model", "stub")
+            created = int(time.time())
+            completion_id = "chatcmpl-" + uuid.uuid4().hex
+            words = VERDICT.split(" ")
+            config.delay(config.first_token_s)
+
+            if not request.get("stream"):
+                config.delay(config.token_s * (len(words) - 1))
+                return self._json(200, {
+                    "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": VERDICT}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(payload):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            for i, word in enumerate(words):
+                if i:
+                    config.delay(config.token_s)
+                send(json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": None,
+                                 "delta": {"content": word if i == 0 else " " + word}}],
+                }))
+            send(json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+            }))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def start_stub(port=0, config=None) -> tuple[ThreadingHTTPServer, str]:
+    """Start the stub on a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(config or StubConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=15)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    cfg = StubConfig(args.first_token_ms / 1000, args.token_ms / 1000, error_rate=args.error_rate)
+    srv, url = start_stub(args.port, cfg)
+    print(f"Stub LLM listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,39 @@
+import hashlib
+
+# ---------- Per-session case state ----------
+# Streamlit reruns the page script on every widget interaction. Step 2 keeps
+# what it has already loaded or paid for (the case record, the verdict and
+# its language, the TTS audio) in st.session_state under the case's token,
+# so a rerun redraws from memory instead of reading the stores or calling the
+# model and TTS again. Works on any mapping, so this module does not import
+# streamlit. Only the MAX_CASES most recent cases are kept per session.
+
+MAX_CASES = 5
+_PREFIX = "case:"
+_ORDER = "case_order"
+
+
+def case_key(token: str | None = None, *link_values) -> str:
+    """The token, or a digest of the link contents for links without one."""
+    if token:
+        return token
+    return "link-" + hashlib.sha1("\x1f".join(v or "" for v in link_values).encode("utf-8")).hexdigest()[:16]
+
+
+def case_state(state, key: str) -> dict:
+    """This session's dict for the case (created on first use; mutate it in place)."""
+    entry = state.get(_PREFIX + key)
+    if entry is None:
+        entry = state[_PREFIX + key] = {}
+    order = [k for k in state.get(_ORDER) or [] if k != key] + [key]
+    for old in order[:-MAX_CASES]:
+        state.pop(_PREFIX + old, None)
+    state[_ORDER] = order[-MAX_CASES:]
+    return entry
+
+
+def remember(entry: dict, field: str, compute):
+    """entry[field], computed once; a None result is not kept, so it is retried on the next rerun."""
+    if entry.get(field) is None:
+        entry[field] = compute()
+    return entry[field]
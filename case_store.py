@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+from metrics import incr
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# ---------- Token-indexed JSONL store ----------
+# The data file stays a plain append-only JSONL log (one record per line).
+# Next to it we keep "<path>.idx", a sidecar of "token<TAB>offset<TAB>length"
+# lines, so a lookup is one dict hit plus one seek instead of JSON-parsing
+# every case ever created.
+#
+# Every process using the data file shares the sidecar. It grows in chunks,
+# each one append ending in a coverage marker "<TAB>end<TAB>inode": all keyed
+# records in bytes [0, end) of that data file are listed above it. Under the
+# exclusive lock on the sidecar a process appends only what lies past the
+# last marker, so no entry is written twice and none is skipped; anything
+# else (data file replaced by compaction, torn or old-format sidecar) is
+# rewritten whole from memory in a temp file and swapped in, so a process
+# starting meanwhile never loads a truncated index.
+
+INDEX_SUFFIX = ".idx"
+
+log = logging.getLogger(__name__)
+
+
+# ---------- Record encoding ----------
+# Several replicas append to the same files on a shared volume. Each record
+# is encoded up front and written with a single O_APPEND write(), so lines
+# from different processes never interleave, and carries a CRC32 of its own
+# bytes in a trailing "_crc" field so a torn or damaged line is detected and
+# reported instead of being silently skipped. Lines without "_crc" (written
+# before checksums existed) are still accepted.
+
+CRC_FIELD = "_crc"
+_CRC_PREFIX = b', "' + CRC_FIELD.encode() + b'": "'
+_CRC_SUFFIX_LEN = len(_CRC_PREFIX) + 8 + 2  # ', "_crc": "' + 8 hex digits + '"}'
+
+
+class CorruptRecord(ValueError):
+    pass
+
+
+def encode_record(record: dict) -> bytes:
+    body = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    if body == b"{}":
+        return b'{"%s": "%08x"}\n' % (CRC_FIELD.encode(), zlib.crc32(body))
+    return body[:-1] + _CRC_PREFIX + b"%08x" % zlib.crc32(body) + b'"}\n'
+
+
+def decode_record(raw: bytes) -> dict:
+    """Parse one line, verifying its checksum; raises CorruptRecord."""
+    line = raw.rstrip(b"\r\n")
+    try:
+        rec = json.loads(line)
+    except ValueError as e:
+        raise CorruptRecord(f"unparseable line: {e}") from None
+    if not isinstance(rec, dict):
+        raise CorruptRecord("not a JSON object")
+    crc = rec.pop(CRC_FIELD, None)
+    if crc is None:
+        return rec  # legacy line
+    if rec:
+        body = line[:-_CRC_SUFFIX_LEN] + b"}"
+    else:
+        body = b"{}"
+    if "%08x" % zlib.crc32(body) != crc:
+        raise CorruptRecord("checksum mismatch")
+    return rec
+
+
+def report_corrupt(path: str, offset: int, reason) -> None:
+    incr("corrupt_records_total", stage=os.path.basename(path))
+    log.warning("Corrupt record in %s at byte %d: %s", path, offset, reason)
+
+
+def append_bytes(path: str, data: bytes, fsync: bool = False):
+    """One O_APPEND write() of whole lines: atomic with respect to other appenders."""
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_bytes(path: str, data: bytes):
+    """Write a temp file next to `path` and swap it in, keeping the file's mode."""
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".idx-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _parse_index_line(raw: bytes):
+    """(token, offset, length), or ("", end, inode) for a coverage marker; None if unparsable."""
+    parts = raw.decode("utf-8", "replace").rstrip("\n").split("\t")
+    if len(parts) != 3:
+        return None
+    try:
+        return parts[0], int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def _last_marker(index_path: str) -> tuple[int, int | None]:
+    """(end, inode) of the sidecar's last line if it is a coverage marker, else (-1, None)."""
+    try:
+        with open(index_path, "rb") as f:
+            f.seek(max(f.seek(0, os.SEEK_END) - 256, 0))
+            tail = f.read()
+    except FileNotFoundError:
+        return -1, None
+    if not tail.endswith(b"\n"):
+        return -1, None
+    entry = _parse_index_line(tail.rsplit(b"\n", 2)[-2])
+    if entry is None or entry[0]:
+        return -1, None
+    return entry[1], entry[2]
+
+
+def index_path_for(path: str, key: str) -> str:
+    # pending_cases.jsonl.idx for tokens, verdicts.jsonl.cache_key.idx for other keys
+    return path + INDEX_SUFFIX if key == "token" else f"{path}.{key}{INDEX_SUFFIX}"
+
+
+class CaseStore:
+    def __init__(self, path: str, key: str = "token"):
+        self.path = path
+        self.key = key
+        self.index_path = index_path_for(path, key)
+        self._lock = path_lock(path)
+        self._offsets = {}      # token -> (offset, length)
+        self._indexed_end = 0   # byte position in the data file covered by the index
+        self._inode = None      # changes when the file is atomically replaced
+        self._loaded = False
+        self._stale = False     # the sidecar must be rewritten whole
+
+    # ----- index maintenance -----
+    def _load_index(self):
+        self._loaded = True
+        self._offsets, self._indexed_end, self._inode = {}, 0, None
+        try:
+            f = open(self.index_path, "rb")
+        except FileNotFoundError:
+            return
+        offsets, chunk = {}, {}
+        covered, inode = 0, None
+        with f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # torn last chunk: only whole chunks count
+                entry = _parse_index_line(raw)
+                if entry is None:
+                    self._stale = True  # damaged or foreign line
+                    break
+                token, a, b = entry
+                if token:
+                    chunk[token] = (a, b)
+                else:
+                    offsets.update(chunk)
+                    chunk = {}
+                    covered, inode = a, b
+            else:
+                self._stale = self._stale or bool(chunk)  # entries without a marker: old format
+        try:
+            data_inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            data_inode = None
+        if inode is not None and inode != data_inode:
+            self._stale = True  # describes a file compaction has since replaced
+            return
+        self._offsets, self._indexed_end, self._inode = offsets, covered, inode
+
+    def _reset_index(self):
+        # Data file was rewritten or truncated (e.g. by compaction): start over.
+        # The sidecar is rewritten from memory once the file has been re-scanned.
+        self._offsets = {}
+        self._indexed_end = 0
+        self._stale = True
+
+    def _save_index(self, start: int, entries: list):
+        """Extend the sidecar with the chunk scanned from `start`, or rewrite it whole."""
+        end = self._indexed_end
+        with file_lock(self.index_path, exclusive=True):
+            covered, inode = _last_marker(self.index_path)
+            if not self._stale and inode == self._inode and start <= covered:
+                if covered < end:  # else another process already covered it
+                    lines = [f"{t}\t{o}\t{n}\n" for t, o, n in entries if o >= covered]
+                    lines.append(f"\t{end}\t{self._inode}\n")
+                    append_bytes(self.index_path, "".join(lines).encode("utf-8"))
+                return
+            lines = [f"{t}\t{o}\t{n}\n" for t, (o, n) in self._offsets.items()]
+            lines.append(f"\t{end}\t{self._inode}\n")
+            replace_bytes(self.index_path, "".join(lines).encode("utf-8"))
+            self._stale = False
+
+    def rebuild(self):
+        """Drop the index and re-scan the whole data file."""
+        with self._lock:
+            self._loaded = True
+            self._reset_index()
+            self.refresh()
+
+    def refresh(self):
+        """Index any records appended to the data file since the last refresh."""
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            try:
+                info = os.stat(self.path)
+            except FileNotFoundError:
+                if self._offsets:
+                    self._reset_index()
+                return
+            if self._inode is not None and (info.st_ino != self._inode or info.st_size < self._indexed_end):
+                self._reset_index()
+            self._inode = info.st_ino
+            start = self._indexed_end
+            if info.st_size == start and not self._stale:
+                return
+
+            new_entries = []
+            with open(self.path, "rb") as f:
+                f.seek(self._indexed_end)
+                offset = self._indexed_end
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break  # partial line from a writer still in progress
+                    length = len(raw)
+                    try:
+                        token = decode_record(raw).get(self.key)
+                    except CorruptRecord as e:
+                        report_corrupt(self.path, offset, e)
+                        token = None
+                    if token:
+                        self._offsets[token] = (offset, length)
+                        new_entries.append((token, offset, length))
+                    offset += length
+                self._indexed_end = offset
+            if self._indexed_end > start or self._stale:
+                self._save_index(start, new_entries)
+
+    # ----- public API -----
+    def append(self, record: dict):
+        line = encode_record(record)
+        with self._lock:
+            self.refresh()
+            with file_lock(self.path):
+                append_bytes(self.path, line)
+            # Let refresh() pick the new line up so that concurrent writers
+            # from other processes are indexed in file order as well.
+            self.refresh()
+
+    def get(self, token: str) -> dict | None:
+        if not token:
+            return None
+        with self._lock:
+            self.refresh()
+            entry = self._offsets.get(token)
+            if entry is None:
+                return None
+            rec = self._read_at(*entry)
+            if rec is None or rec.get(self.key) != token:
+                # Stale index (file replaced underneath us): rebuild once.
+                self._reset_index()
+                self.refresh()
+                entry = self._offsets.get(token)
+                rec = self._read_at(*entry) if entry else None
+            return rec
+
+    def __contains__(self, token: str) -> bool:
+        with self._lock:
+            self.refresh()
+            return token in self._offsets
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.refresh()
+            return len(self._offsets)
+
+    def _read_at(self, offset: int, length: int) -> dict | None:
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                raw = f.read(length)
+        except OSError:
+            return None
+        try:
+            return decode_record(raw)
+        except CorruptRecord as e:
+            report_corrupt(self.path, offset, e)
+            return None
+
+
+# ---------- Per-file locks ----------
+# Everything in this process that writes or rewrites a given JSONL file
+# (appends, the index, compaction) serialises on the same lock. Across
+# processes, appenders hold a shared flock on "<path>.lock" for the length of
+# one write, and compaction holds it exclusively while it copies the tail and
+# swaps the rewritten file in, so no append can land in a file being replaced.
+LOCK_SUFFIX = ".lock"
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def path_lock(path: str) -> threading.RLock:
+    key = os.path.abspath(path)
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = threading.RLock()
+        return lock
+
+
+@contextmanager
+def file_lock(path: str, exclusive: bool = False):
+    """path_lock plus a shared (appenders) or exclusive (compaction) flock on <path>.lock."""
+    with path_lock(path):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)  # releases the flock
+
+
+# ---------- Plain JSONL helpers ----------
+def append_jsonl(path: str, record: dict):
+    line = encode_record(record)
+    with file_lock(path):
+        append_bytes(path, line)
+
+
+def iter_jsonl(path: str):
+    """Yield verified records; corrupt lines are reported, a torn tail is left alone."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        offset = 0
+        for raw in f:
+            start, offset = offset, offset + len(raw)
+            if not raw.endswith(b"\n"):
+                break  # partial line from a writer still in progress
+            if not raw.strip():
+                continue
+            try:
+                yield decode_record(raw)
+            except CorruptRecord as e:
+                report_corrupt(path, start, e)
+
+
+# ---------- One store per file per process ----------
+# Streamlit re-executes the page script on every interaction, but imported
+# modules survive, so the index is only loaded from disk once per process.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(path: str, key: str = "token") -> CaseStore:
+    with _stores_lock:
+        store = _stores.get((path, key))
+        if store is None:
+            store = _stores[(path, key)] = CaseStore(path, key)
+    store.refresh()  # migrates a pre-existing JSONL on first open
+    return store
@@ -0,0 +1,244 @@
+import glob
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from case_store import CorruptRecord, decode_record, file_lock, iter_jsonl, open_store, report_corrupt
+from metrics import incr
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# ---------- Settings ----------
+PENDING_TTL_DAYS = float(os.getenv("PENDING_TTL_DAYS", "30"))
+COMPACTION_INTERVAL_S = float(os.getenv("COMPACTION_INTERVAL_S", "3600"))
+
+log = logging.getLogger(__name__)
+
+
+# ---------- Helpers ----------
+def _parse_ts(value):
+    try:
+        return datetime.fromisoformat(value)
+    except Exception:
+        return None
+
+
+def _record_token(rec: dict):
+    # judgeit.py stores the token top-level, fairfight.py under "meta"
+    return rec.get("token") or (rec.get("meta") or {}).get("token")
+
+
+def verdict_segments(verdicts_path: str) -> list[str]:
+    """Active verdict log plus its dated segments, oldest first."""
+    stem, ext = os.path.splitext(verdicts_path)
+    return sorted(glob.glob(f"{stem}.????-??-??{ext}")) + [verdicts_path]
+
+
+def resolved_tokens(verdicts_path: str) -> set:
+    tokens = set()
+    for seg in verdict_segments(verdicts_path):
+        for rec in iter_jsonl(seg):
+            tok = _record_token(rec)
+            if tok:
+                tokens.add(tok)
+    return tokens
+
+
+def _rewrite(path: str, keep, spill=None, before_replace=None) -> tuple[int, int]:
+    """
+    Atomically rewrite `path`, keeping the raw lines for which keep(rec) is true.
+    Lines that are not kept are passed to spill(rec, raw) when given, and
+    before_replace() runs just before the rewritten file is swapped in.
+
+    The bulk of the work runs without the file lock; only the final tail copy
+    (records appended while we were filtering) and the rename hold it, so
+    writers, in this process or any other, are blocked for milliseconds at most.
+    """
+    kept = dropped = 0
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".compact-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out, open(path, "rb") as src:
+            os.chmod(tmp_path, stat.S_IMODE(os.fstat(src.fileno()).st_mode))  # not mkstemp's 0600
+            def copy_from(f):
+                nonlocal kept, dropped
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        out.write(raw)  # keep a torn tail as-is, never lose bytes
+                        break
+                    try:
+                        rec = decode_record(raw)
+                    except CorruptRecord as e:
+                        report_corrupt(path, f.tell() - len(raw), e)
+                        dropped += 1
+                        continue
+                    if keep(rec):
+                        out.write(raw)
+                        kept += 1
+                    else:
+                        dropped += 1
+                        if spill:
+                            spill(rec, raw)
+
+            copy_from(src)
+            with file_lock(path, exclusive=True):
+                copy_from(src)  # anything appended during the first pass
+                out.flush()
+                os.fsync(out.fileno())
+                if before_replace:
+                    before_replace()
+                os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return kept, dropped
+
+
+# ---------- Pending cases ----------
+def compact_pending(pending_path: str, verdicts_path: str, ttl_days: float = PENDING_TTL_DAYS) -> tuple[int, int]:
+    """Drop pending cases that already have a verdict or are older than ttl_days."""
+    if not os.path.exists(pending_path):
+        return 0, 0
+    done = resolved_tokens(verdicts_path)
+    cutoff = datetime.utcnow() - timedelta(days=ttl_days) if ttl_days else None
+
+    def keep(rec):
+        if rec.get("token") in done:
+            return False
+        created = _parse_ts(rec.get("created_at"))
+        if cutoff and created and created < cutoff:
+            return False
+        return True
+
+    result = _rewrite(pending_path, keep)
+    open_store(pending_path).rebuild()
+    return result
+
+
+# ---------- Verdict log rotation ----------
+class _Segment:
+    """
+    A dated segment rebuilt in a temp file (existing lines + spilled ones) and
+    swapped in with os.replace. Lines already in the segment are skipped, so a
+    rotation cut short between publishing the segments and replacing the
+    active log leaves no duplicates once the next rotation has run.
+    """
+
+    def __init__(self, path: str, mode: int):
+        self.path = path
+        self.seen = set()
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".rotate-", dir=os.path.dirname(os.path.abspath(path)))
+        self.out = os.fdopen(fd, "wb")
+        try:
+            with open(path, "rb") as f:
+                os.chmod(self.tmp_path, stat.S_IMODE(os.fstat(f.fileno()).st_mode))
+                for raw in f:
+                    self.out.write(raw)
+                    self.seen.add(hashlib.sha1(raw).digest())
+        except FileNotFoundError:
+            os.chmod(self.tmp_path, mode)
+
+    def add(self, raw: bytes):
+        digest = hashlib.sha1(raw).digest()
+        if digest not in self.seen:
+            self.seen.add(digest)
+            self.out.write(raw)
+
+    def publish(self):
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.out.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.out.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def rotate_verdicts(verdicts_path: str) -> int:
+    """
+    Move verdicts from previous days into dated segments
+    (verdicts.jsonl -> verdicts.2025-01-31.jsonl); today's stay in the active log.
+    The segments are published before the active log is replaced.
+    """
+    if not os.path.exists(verdicts_path):
+        return 0
+    stem, ext = os.path.splitext(verdicts_path)
+    today = datetime.utcnow().date()
+    mode = stat.S_IMODE(os.stat(verdicts_path).st_mode)
+    segments = {}
+
+    def keep(rec):
+        ts = _parse_ts(rec.get("timestamp"))
+        return ts is None or ts.date() >= today
+
+    def spill(rec, raw):
+        day = _parse_ts(rec.get("timestamp")).date().isoformat()
+        if day not in segments:
+            segments[day] = _Segment(f"{stem}.{day}{ext}", mode)
+        segments[day].add(raw)
+
+    def publish():
+        for segment in segments.values():
+            segment.publish()
+
+    try:
+        _, moved = _rewrite(verdicts_path, keep, spill, before_replace=publish)
+    finally:
+        for segment in segments.values():
+            segment.discard()
+    return moved
+
+
+# ---------- Background runner ----------
+def run_compaction(pending_path: str, verdicts_path: str, ttl_days: float = PENDING_TTL_DAYS):
+    # Only one replica compacts at a time; the others skip this round.
+    lock_path = pending_path + ".compact.lock"
+    with open(lock_path, "w") as lock_file:
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+        moved = rotate_verdicts(verdicts_path)
+        kept, dropped = compact_pending(pending_path, verdicts_path, ttl_days)
+        incr("compaction_runs_total")
+        incr("verdicts_rotated_total", moved)
+        incr("pending_cases_dropped_total", dropped)
+        return {"pending_kept": kept, "pending_dropped": dropped, "verdicts_rotated": moved}
+
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def start_background_compaction(pending_path: str, verdicts_path: str,
+                                ttl_days: float = PENDING_TTL_DAYS,
+                                interval_s: float = COMPACTION_INTERVAL_S):
+    """Start a daemon thread (once per process) that compacts every interval_s seconds."""
+    key = (os.path.abspath(pending_path), os.path.abspath(verdicts_path))
+    with _started_lock:
+        if key in _started:
+            return
+        _started.add(key)
+
+    def loop():
+        while True:
+            try:
+                run_compaction(pending_path, verdicts_path, ttl_days)
+            except Exception:
+                incr("compaction_errors_total")
+                log.exception("Compaction of %s / %s failed", pending_path, verdicts_path)
+            time.sleep(interval_s)
+
+    threading.Thread(target=loop, name="jsonl-compaction", daemon=True).start()
@@ -1,46 +1,211 @@
+import os
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import Json, execute_values
 import streamlit as st
 
+def _setting(name, default):
+    # Streamlit secrets first, then environment (handy for a local Postgres)
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        value = None
+    return value or os.getenv(name, default)
+
 # 🔐 Load DB config from Streamlit secrets
 DB_CONFIG = {
-    "host": st.secrets.get("DB_HOST", "localhost"),
-    "port": st.secrets.get("DB_PORT", "5432"),
-    "dbname": st.secrets.get("DB_NAME", "postgres"),
-    "user": st.secrets.get("DB_USER", "postgres"),
-    "password": st.secrets.get("DB_PASSWORD", "1234"),
+    "host": _setting("DB_HOST", "localhost"),
+    "port": _setting("DB_PORT", "5432"),
+    "dbname": _setting("DB_NAME", "postgres"),
+    "user": _setting("DB_USER", "postgres"),
+    "password": _setting("DB_PASSWORD", "1234"),
 }
+DB_POOL_MIN = int(_setting("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(_setting("DB_POOL_MAX", "10"))
+
+# ---------- Schema migrations ----------
+# Applied in order, exactly once per database; schema_version records progress.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS verdicts (
+        id SERIAL PRIMARY KEY,
+        theme TEXT,
+        user1_name TEXT,
+        user2_name TEXT,
+        user1_input TEXT,
+        user2_input TEXT,
+        verdict TEXT,
+        user1_email TEXT,
+        user2_email TEXT,
+        user1_phone TEXT,
+        user2_phone TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS verdicts_created_at_idx ON verdicts (created_at)",
+    "CREATE INDEX IF NOT EXISTS verdicts_theme_idx ON verdicts (theme)",
+    # Structured verdict fields (verdict_parse.parse_verdict)
+    """
+    ALTER TABLE verdicts
+        ADD COLUMN IF NOT EXISTS lang TEXT,
+        ADD COLUMN IF NOT EXISTS winner SMALLINT,
+        ADD COLUMN IF NOT EXISTS user1_pct REAL,
+        ADD COLUMN IF NOT EXISTS user2_pct REAL,
+        ADD COLUMN IF NOT EXISTS key_arguments JSONB
+    """,
+    # History lookups (verdict_history): newest first per participant and per theme.
+    # Contacts are matched normalised, as history.normalize_contact does.
+    "CREATE INDEX IF NOT EXISTS verdicts_user1_email_idx ON verdicts (lower(user1_email), created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS verdicts_user2_email_idx ON verdicts (lower(user2_email), created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS verdicts_user1_phone_idx "
+    "ON verdicts (regexp_replace(user1_phone, '[^0-9]', '', 'g'), created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS verdicts_user2_phone_idx "
+    "ON verdicts (regexp_replace(user2_phone, '[^0-9]', '', 'g'), created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS verdicts_theme_created_idx ON verdicts (theme, created_at DESC, id DESC)",
+]
+
+_MIGRATION_LOCK_ID = 0x66616972  # pg_advisory_xact_lock key, "fair"
+
+def migrate(conn):
+    with conn.cursor() as cur:
+        # Serialise replicas starting at the same time
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_ID,))
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = cur.fetchone()[0]
+        for version, statement in enumerate(MIGRATIONS, start=1):
+            if version <= current:
+                continue
+            cur.execute(statement)
+            cur.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+    conn.commit()
+
+# ---------- Connection pool ----------
+@st.cache_resource
+def get_pool():
+    # One pool per server process, shared across reruns and sessions.
+    # Migrations run here, i.e. once, instead of on every insert.
+    p = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_CONFIG)
+    conn = p.getconn()
+    try:
+        migrate(conn)
+    finally:
+        p.putconn(conn)
+    return p
+
+@contextmanager
+def connection():
+    p = get_pool()
+    conn = p.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        p.putconn(conn, close=bool(conn.closed))  # drop connections the server closed
 
 def get_connection():
     return psycopg2.connect(**DB_CONFIG)
 
 def save_verdict(theme, user1_name, user2_name, user1_input, user2_input, verdict,
-                 user1_email=None, user2_email=None, user1_phone=None, user2_phone=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS verdicts (
-            id SERIAL PRIMARY KEY,
-            theme TEXT,
-            user1_name TEXT,
-            user2_name TEXT,
-            user1_input TEXT,
-            user2_input TEXT,
-            verdict TEXT,
-            user1_email TEXT,
-            user2_email TEXT,
-            user1_phone TEXT,
-            user2_phone TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    cur.execute("""
-        INSERT INTO verdicts (
-            theme, user1_name, user2_name, user1_input, user2_input, verdict,
-            user1_email, user2_email, user1_phone, user2_phone
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (theme, user1_name, user2_name, user1_input, user2_input, verdict,
-          user1_email, user2_email, user1_phone, user2_phone))
-    conn.commit()
-    cur.close()
-    conn.close()
+                 user1_email=None, user2_email=None, user1_phone=None, user2_phone=None,
+                 lang=None, winner=None, user1_pct=None, user2_pct=None, key_arguments=None):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO verdicts (
+                    theme, user1_name, user2_name, user1_input, user2_input, verdict,
+                    user1_email, user2_email, user1_phone, user2_phone,
+                    lang, winner, user1_pct, user2_pct, key_arguments
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (theme, user1_name, user2_name, user1_input, user2_input, verdict,
+                  user1_email, user2_email, user1_phone, user2_phone,
+                  lang, winner, user1_pct, user2_pct,
+                  Json(key_arguments) if key_arguments is not None else None))
+
+VERDICT_COLUMNS = (
+    "theme", "user1_name", "user2_name", "user1_input", "user2_input", "verdict",
+    "user1_email", "user2_email", "user1_phone", "user2_phone",
+    "lang", "winner", "user1_pct", "user2_pct", "key_arguments",
+)
+JSON_COLUMNS = {"key_arguments"}
+
+def _column_value(record, column):
+    value = record.get(column)
+    return Json(value) if column in JSON_COLUMNS and value is not None else value
+
+def save_verdicts(records):
+    """Insert many verdict dicts with a single multi-row INSERT (missing keys become NULL)."""
+    if not records:
+        return
+    rows = [tuple(_column_value(r, c) for c in VERDICT_COLUMNS) for r in records]
+    with connection() as conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"INSERT INTO verdicts ({', '.join(VERDICT_COLUMNS)}) VALUES %s",
+                rows,
+                page_size=1000,
+            )
+
+# ---------- History ----------
+_CONTACT_MATCH = {
+    "email": "(lower(user1_email) = %(value)s OR lower(user2_email) = %(value)s)",
+    "tel": "(regexp_replace(user1_phone, '[^0-9]', '', 'g') = %(value)s "
+           "OR regexp_replace(user2_phone, '[^0-9]', '', 'g') = %(value)s)",
+}
+
+def verdict_history(contact=None, theme=None, cursor=None, limit=20):
+    """
+    Newest verdicts first, by participant email/phone and/or theme:
+    (rows, next cursor or None). Keyset pagination on (created_at, id), so
+    every page is an index range scan however deep the user pages.
+    """
+    from history import decode_cursor, encode_cursor, normalize_contact
+
+    where, params = [], {"limit": limit + 1}
+    if contact:
+        key = normalize_contact(contact)
+        if key is None:
+            return [], None
+        kind, _, params["value"] = key.partition(":")
+        where.append(_CONTACT_MATCH[kind])
+    if theme:
+        where.append("theme = %(theme)s")
+        params["theme"] = theme
+    after = decode_cursor(cursor)
+    if after:
+        where.append("(created_at, id) < (%(after_ts)s, %(after_id)s)")
+        params["after_ts"], params["after_id"] = after
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT id, created_at, theme, user1_name, user2_name, lang, winner, user1_pct, user2_pct,
+                       left(verdict, 200) AS summary
+                FROM verdicts
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %(limit)s
+            """, params)
+            columns = [c.name for c in cur.description]
+            rows = [dict(zip(columns, r)) for r in cur.fetchall()]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    for r in rows:
+        r["created_at"] = r["created_at"].isoformat()
+        r["status"] = "decided"
+    return rows, encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if more else None
+
+if __name__ == "__main__":
+    # Smoke test against a local Postgres: DB_HOST=localhost python db.py
+    save_verdict("Test", "Alex", "Sam", "a", "b", "60% vs 40%")
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        print("schema version:", cur.fetchone()[0])
+        cur.execute("SELECT COUNT(*) FROM verdicts")
+        print("verdicts:", cur.fetchone()[0])
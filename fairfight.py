@@ -1,45 +1,57 @@
 # fairfight.py
 import streamlit as st
-import openai
-import re
-import base64
-import json
 import urllib.parse
-from urllib.parse import urlencode
 from datetime import datetime
-from gtts import gTTS
-import tempfile
-from langdetect import detect, DetectorFactory
-from deep_translator import GoogleTranslator
-import uuid
 import os
+import time
+
+from case_session import case_key, case_state, remember
+from case_store import append_jsonl, iter_jsonl, open_store
+from compaction import start_background_compaction
+from history import open_history, start_background_refresh
+from judge import Judge
+from links import (decode_payload, legacy_b64_decode, new_token, payload_link, signin_link, token_link,
+                   verify_signin, verify_token)
+from llm import make_backend
+from mailer import enabled as mail_enabled, send_mail
+from metrics import Trace, start_metrics_server, timed
+from language import preload as preload_language
+from pipeline import preload_modules, submit
+from tts import synthesize
+from verdict_cache import is_error, open_cache, verdict_for_token
+from verdict_parse import parse_verdict, verdict_fields
+from write_behind import jsonl_writer, postgres_writer
 
 # ---------- Streamlit page config ----------
 st.set_page_config(page_title="FairFight AI", page_icon="⚖️")
 
-# ---------- Deterministic language detection ----------
-DetectorFactory.seed = 0
-
-# ---------- OpenAI setup ----------
-openai.api_key = st.secrets["openai"]["api_key"]
-openai.api_base = "https://api.openai.com/v1"
-
 # ---------- Constants ----------
 BASE_URL = "https://fairfight.streamlit.app"
 PENDING_DB = "pending_cases.jsonl"   # stores step-1 payloads until step-2
 VERDICTS_DB = "verdicts.jsonl"       # append-only log of delivered verdicts
-
-# ---------- Helpers: robust Base64 (URL-safe) ----------
-def b64url_encode(s: str) -> str:
-    return base64.urlsafe_b64encode(s.encode("utf-8")).decode("utf-8").rstrip("=")
-
-def b64url_decode(s: str) -> str:
-    if not s:
-        return ""
-    s = s.replace(" ", "+")  # guard against clients turning + into space
-    pad_len = (4 - len(s) % 4) % 4
-    s += "=" * pad_len
-    return base64.urlsafe_b64decode(s.encode("utf-8")).decode("utf-8")
+PERSIST_TO_POSTGRES = bool(st.secrets.get("DB_HOST") or os.getenv("DB_HOST"))  # also mirror verdicts to db.py
+# "token": short link to the stored case; "payload": case travels in the link (stored only if too long)
+LINK_MODE = os.getenv("LINK_MODE", "token")
+
+# ---------- Process-wide startup (once per server process, not per rerun) ----------
+@st.cache_resource
+def start_services():
+    # Index existing cases (migrates a pre-existing JSONL)
+    open_store(PENDING_DB)
+    # Drop resolved/expired cases and rotate the verdict log off the request path
+    start_background_compaction(PENDING_DB, VERDICTS_DB)
+    # Keep the "My cases" index caught up with both logs
+    start_background_refresh(open_history(PENDING_DB, VERDICTS_DB))
+    # Prometheus text on http://127.0.0.1:$METRICS_PORT/metrics when METRICS_PORT is set
+    start_metrics_server()
+    return True
+
+@st.cache_resource
+def warm_step_2():
+    # openai, gTTS and the language profiles load on the pool while User 2 types
+    return [submit(preload_language), *preload_modules("openai", "gtts")]
+
+start_services()
 
 # ---------- Helpers: query params (works on new/old Streamlit) ----------
 def get_query_params():
@@ -59,52 +71,62 @@ def qget(q, key, default=""):
 # ---------- Persistence: append-only JSONL ----------
 def _append_jsonl(path: str, record: dict):
     try:
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        append_jsonl(path, record)
     except Exception as e:
         st.warning(f"⚠️ Could not write to {path}: {e}")
 
 def _iter_jsonl(path: str):
-    if not os.path.exists(path):
-        return
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                yield json.loads(line)
-            except:
-                continue
+    return iter_jsonl(path)
 
 # ---------- Cases storage for Step 1 -> Step 2 handoff ----------
 def save_case(payload: dict) -> str:
-    token = uuid.uuid4().hex
+    token = new_token()
     record = dict(payload)
     record["token"] = token
     record["created_at"] = datetime.utcnow().isoformat()
-    _append_jsonl(PENDING_DB, record)
+    try:
+        open_store(PENDING_DB).append(record)
+    except Exception as e:
+        st.warning(f"⚠️ Could not write to {PENDING_DB}: {e}")
     return token
 
 def load_case(token: str) -> dict | None:
-    for rec in _iter_jsonl(PENDING_DB):
-        if rec.get("token") == token:
-            return rec
-    return None
+    if not verify_token(token):
+        return None  # forged or mangled link: no disk I/O
+    try:
+        with timed("load_case"):
+            return open_store(PENDING_DB).get(token)
+    except Exception:
+        return None
 
 # ---------- Verdicts log ----------
-def save_verdict(theme, user1_name, user2_name, user1_input, user2_input, verdict, **kwargs):
+def save_verdict(theme, user1_name, user2_name, user1_input, user2_input, verdict,
+                 token=None, lang=None, cache_key=None, user1_email=None, user2_email=None,
+                 user1_phone=None, user2_phone=None, **kwargs):
     record = {
         "timestamp": datetime.utcnow().isoformat(),
+        "token": token,
         "theme": theme,
         "user1_name": user1_name,
         "user2_name": user2_name,
         "user1_input": user1_input,
         "user2_input": user2_input,
+        "user1_email": user1_email or None,  # indexed for "My cases" (and Postgres history)
+        "user2_email": user2_email or None,
+        "user1_phone": user1_phone or None,
+        "user2_phone": user2_phone or None,
         "verdict": verdict,
+        "lang": lang,
+        "cache_key": cache_key,  # lets the verdict cache find exact repeats
+        # streamed as prose, so the typed fields come from the fallback parser
+        **verdict_fields(parse_verdict(verdict, user1_name, user2_name, lang)),
         "meta": kwargs,
     }
-    _append_jsonl(VERDICTS_DB, record)
+    # Write-behind: batched off the request thread, flushed on shutdown
+    jsonl_writer(VERDICTS_DB).put(record)
+    if PERSIST_TO_POSTGRES:
+        postgres_writer().put(record)
+    open_cache(VERDICTS_DB).remember(cache_key, verdict, lang)
 
 # ---------- Link helpers ----------
 def generate_mailto_link(email, subject, body):
@@ -118,45 +140,45 @@ def generate_whatsapp_link(phone, msg):
     return f"https://wa.me/{phone}?text={msg}"
 
 # ---------- JudgeBot core ----------
-def analyze_conflict(user1_input, user2_input, theme, user1_name, user2_name):
-    try:
-        text_for_lang = (user1_input or "") + " " + (user2_input or "")
-        text_for_lang = text_for_lang.strip() or "en"
-        try:
-            lang_code = detect(text_for_lang)
-        except Exception:
-            lang_code = "en"
-
-        system_instruction = (
-            "You are JudgeBot, an impartial AI judge. Analyze both sides carefully, "
-            "highlight key arguments from each, and give a fair verdict. Clearly state "
-            "who is more reasonable, and give a win percentage (e.g., 60% vs 40%). "
-            "You should give the response in the user texted language"
-        )
-
-        try:
-            system_instruction_translated = GoogleTranslator(source="en", target=lang_code).translate(system_instruction)
-        except Exception:
-            system_instruction_translated = system_instruction
-
-        # Keep the user-facing message structure simple and neutral
-        user_prompt = (
-            f"{user1_name} says:\n{user1_input}\n\n"
-            f"{user2_name} says:\n{user2_input}\n\n"
-            "Who is more reasonable and why? Provide a win percentage as well."
-        )
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_instruction_translated},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content, lang_code
-    except Exception as e:
-        return f"❌ Error: {e}", "en"
+SYSTEM_INSTRUCTION = (
+    "You are JudgeBot, an impartial AI judge. Analyze both sides carefully, "
+    "highlight key arguments from each, and give a fair verdict. Clearly state "
+    "who is more reasonable, and give a win percentage (e.g., 60% vs 40%). "
+    "You should give the response in the user texted language"
+)
+
+# Keep the user-facing message structure simple and neutral
+USER_PROMPT = (
+    "{user1_name} says:\n{user1_input}\n\n"
+    "{user2_name} says:\n{user2_input}\n\n"
+    "Who is more reasonable and why? Provide a win percentage as well."
+)
+
+@st.cache_resource
+def get_judge():
+    # One backend (and HTTP connection pool) per server process, reused across reruns
+    backend = make_backend("openai", api_key=st.secrets["openai"]["api_key"])
+    return Judge(backend, VERDICTS_DB, SYSTEM_INSTRUCTION, USER_PROMPT, error_prefix="❌ Error")
+
+def dispute_key(user1_input, user2_input, theme, user1_name, user2_name):
+    return get_judge().dispute_key(user1_input, user2_input, theme, user1_name, user2_name)
+
+def analyze_conflict(user1_input, user2_input, theme, user1_name, user2_name, structured=False):
+    return get_judge().analyze(user1_input, user2_input, theme, user1_name, user2_name, structured)
+
+def stream_conflict(user1_input, user2_input, theme, user1_name, user2_name, trace=None):
+    """Same as analyze_conflict, but returns (GuardedStream of text chunks, lang_code)."""
+    return get_judge().stream(user1_input, user2_input, theme, user1_name, user2_name, trace)
+
+def render_stream(chunks) -> str:
+    """Render chunks as they arrive and return the full text."""
+    if hasattr(st, "write_stream"):
+        return st.write_stream(chunks)
+    placeholder, text = st.empty(), ""
+    for chunk in chunks:
+        text += chunk
+        placeholder.markdown(text)
+    return text
 
 # ---------- UI: Step 1 ----------
 def step_1(theme):
@@ -179,8 +201,7 @@ def step_1(theme):
             st.warning("⚠️ Please fill all required fields.")
             return
 
-        # Save minimal payload server-side and send only a token
-        token = save_case({
+        case = {
             "theme": theme,
             "user1_name": user1_name,
             "user1_email": user1_email,
@@ -189,9 +210,11 @@ def step_1(theme):
             "user2_email": user2_email,
             "user2_phone": user2_phone,
             "user1_input": user1_input,
-        })
-
-        share_link = f"{BASE_URL}/?step=2&token={token}"
+        }
+        share_link = payload_link(BASE_URL, case) if LINK_MODE == "payload" else None
+        if share_link is None:
+            # Save the case server-side and send only a short signed token
+            share_link = token_link(BASE_URL, save_case(case))
         st.success("✅ Link generated!")
         st.code(share_link, language="text")
 
@@ -210,31 +233,62 @@ def step_1(theme):
             whatsapp_link = generate_whatsapp_link(user2_phone, msg)
             st.markdown(f"[📲 WhatsApp to {user2_name}]({whatsapp_link})", unsafe_allow_html=True)
 
-        # (Optional) Also provide a base64 URL fallback for environments where writing files is blocked
-        encoded_input = b64url_encode(user1_input)
-        fallback_params = urlencode({
-            "step": "2",
-            "theme": theme,
-            "user1_name": user1_name,
-            "user2_name": user2_name,
-            "user1_input": encoded_input,
-            "user1_email": user1_email,
-            "user2_email": user2_email,
-            "user1_phone": user1_phone,
-            "user2_phone": user2_phone,
-        })
-        fallback_link = f"{BASE_URL}/?{fallback_params}"
-        with st.expander("Fallback link (URL-embedded data)"):
-            st.code(fallback_link, language="text")
-            st.caption("Use only if the main link fails. This one is longer and more fragile.")
+        # (Optional) Self-contained link for when the stored case can't be reached;
+        # only offered while it is short enough to survive mail and chat clients
+        fallback_link = payload_link(BASE_URL, case) if LINK_MODE == "token" else None
+        if fallback_link:
+            with st.expander("Fallback link (URL-embedded data)"):
+                st.code(fallback_link, language="text")
+                st.caption("Use only if the main link fails. This one is longer and more fragile.")
 
 # ---------- UI: Step 2 ----------
+def notify_user1(user1_name, user2_name, user1_email, user1_phone, verdict):
+    msg = (
+        f"Hello {user1_name},\n\n🎯 The conflict between you and {user2_name} "
+        f"has been analyzed by JudgeBot.\n\nHere is the verdict:\n{verdict}\n\n"
+        f"🤖 FairFight AI – Objective Conflict Resolution"
+    )
+
+    if user1_email:
+        email_link = generate_mailto_link(user1_email, "FairFight AI Verdict", msg)
+        st.markdown(f"[📧 Notify {user1_name} by Email]({email_link})", unsafe_allow_html=True)
+
+    if user1_phone:
+        whatsapp_link = generate_whatsapp_link(user1_phone, msg)
+        st.markdown(f"[📲 Notify {user1_name} on WhatsApp]({whatsapp_link})", unsafe_allow_html=True)
+
+def play_verdict(state, slot, speech=None):
+    """Audio kept in the session, or the pending TTS result (then kept for later reruns)."""
+    if state.get("audio") is None and speech is not None:
+        try:
+            state["audio"] = speech.result()
+        except Exception as e:
+            slot.warning(f"🔈 Could not generate speech: {e}")
+            return
+    if state.get("audio"):
+        slot.audio(state["audio"], format="audio/mp3")
+
 def step_2(data):
-    st.subheader(f"2️⃣ {data.get('theme', 'Conflict')} - Step 2: {data.get('user2_name', 'User 2')} Responds")
+    warm_step_2()
+    token = data.get("token", "")
+    # Loaded once per session and case: reruns (typing, buttons, audio) redraw from memory
+    state = case_state(st.session_state, case_key(token, data.get("c"), data.get("user1_input")))
+
+    # Compressed, signed case carried in the link itself (store-less links)
+    case = remember(state, "case", lambda: decode_payload(data["c"])) if data.get("c") else None
+    header = case or data
+    st.subheader(f"2️⃣ {header.get('theme', 'Conflict')} - Step 2: {header.get('user2_name', 'User 2')} Responds")
+
+    # Already judged? Looked up before the case itself: compaction drops a case
+    # once it has a verdict, and the verdict record carries the case fields
+    if token and not state.get("verdict_checked"):
+        previous = verdict_for_token(VERDICTS_DB, token) if verify_token(token) else None
+        state["verdict_checked"] = True
+        if previous:
+            state.update(record=previous, verdict=previous["verdict"], lang=previous.get("lang"), earlier=True)
 
     # Preferred: load via token
-    token = data.get("token", "")
-    record = load_case(token) if token else None
+    record = remember(state, "record", lambda: load_case(token)) if token else None
 
     if record:
         # From token record
@@ -246,8 +300,20 @@ def step_2(data):
         user2_email = record.get("user2_email", data.get("user2_email", ""))
         user2_phone = record.get("user2_phone", data.get("user2_phone", ""))
         user1_input_decoded = record.get("user1_input", "")
+    elif data.get("c"):
+        if case is None:
+            st.error("❌ The link appears corrupted. Ask User 1 to resend the link.")
+            return
+        theme = case.get("theme", "Conflict")
+        user1_name = case.get("user1_name", "User 1")
+        user1_email = case.get("user1_email", "")
+        user1_phone = case.get("user1_phone", "")
+        user2_name = case.get("user2_name", "User 2")
+        user2_email = case.get("user2_email", "")
+        user2_phone = case.get("user2_phone", "")
+        user1_input_decoded = case.get("user1_input", "")
     else:
-        # Fallback: use query params (base64)
+        # Links issued before compressed payloads: plain query params (base64)
         theme = data.get("theme", "Conflict")
         user1_name = data.get("user1_name", "User 1")
         user1_email = data.get("user1_email", "")
@@ -256,7 +322,7 @@ def step_2(data):
         user2_email = data.get("user2_email", "")
         user2_phone = data.get("user2_phone", "")
         try:
-            user1_input_decoded = b64url_decode(data.get("user1_input", ""))
+            user1_input_decoded = legacy_b64_decode(data.get("user1_input", ""))
         except Exception:
             st.error("❌ The link appears corrupted. Ask User 1 to resend the link.")
             return
@@ -264,6 +330,20 @@ def step_2(data):
     st.markdown(f"**🧑 {user1_name} said:**")
     st.info(user1_input_decoded or "—")
 
+    # Already judged: show the stored verdict instead of paying for another call
+    if state.get("earlier"):
+        st.success("✅ This conflict already has a verdict.")
+        st.markdown(state["verdict"])
+        return
+
+    # Delivered in this session: redraw it (and its audio) without new calls
+    if state.get("verdict"):
+        st.success("✅ Verdict delivered!")
+        st.markdown(state["verdict"])
+        notify_user1(user1_name, user2_name, user1_email, user1_phone, state["verdict"])
+        play_verdict(state, st.empty())
+        return
+
     user2_input = st.text_area(f"👩 {user2_name}, your version")
 
     if st.button("🧠 Get Verdict from JudgeBot"):
@@ -271,35 +351,117 @@ def step_2(data):
             st.warning("⚠️ Please enter your version before requesting the verdict.")
             return
 
-        verdict, lang_code = analyze_conflict(user1_input_decoded, user2_input, theme, user1_name, user2_name)
-        save_verdict(theme, user1_name, user2_name, user1_input_decoded, user2_input, verdict, token=token if record else None)
+        trace = Trace(app="fairfight", token=token if record else None)
+        chunks, lang_code = stream_conflict(user1_input_decoded, user2_input, theme, user1_name, user2_name, trace=trace)
+        verdict = render_stream(chunks)
+        if chunks.error or is_error(verdict):
+            # Never persisted (nor a verdict cut off mid-stream): the next attempt must reach the model again
+            st.warning("⚠️ JudgeBot could not deliver a verdict right now. Please try again in a moment.")
+            return
 
+        # TTS (best-effort) synthesizes in the background while we persist and
+        # render the notify links; the audio fills its slot once it is ready
+        speech = submit(synthesize, verdict, lang_code or "en")
         st.success("✅ Verdict delivered!")
-        st.markdown(verdict)
-
-        # TTS (best-effort)
+        audio_slot = st.empty()
+
+        with trace.stage("save_verdict"):
+            save_verdict(theme, user1_name, user2_name, user1_input_decoded, user2_input, verdict,
+                         token=token if record else None, lang=lang_code,
+                         user1_email=user1_email, user2_email=user2_email,
+                         user1_phone=user1_phone, user2_phone=user2_phone,
+                         cache_key=dispute_key(user1_input_decoded, user2_input, theme, user1_name, user2_name))
+        state.update(verdict=verdict, lang=lang_code)
+
+        notify_user1(user1_name, user2_name, user1_email, user1_phone, verdict)
+
+        with trace.stage("tts_wait"):
+            play_verdict(state, audio_slot, speech)
+        trace.emit()
+
+# ---------- UI: My cases ----------
+SIGNIN_COOLDOWN_S = 60
+
+def sign_in(code: str):
+    # Opened from the mailed sign-in link (?step=cases&k=...)
+    contact = verify_signin(code)
+    if contact:
+        st.session_state.history_contact = contact
+        # Used up: drop the code from the address bar so signing out sticks
+        if hasattr(st, "query_params"):
+            st.query_params.clear()
+        else:
+            st.experimental_set_query_params()
+    elif not st.session_state.get("history_contact"):
+        st.error("❌ This sign-in link is invalid or has expired. Ask for a new one under 📂 My cases.")
+
+def request_signin():
+    if not mail_enabled():
+        st.caption("Sign-in by email is not configured on this server.")
+        return
+    email = st.text_input("📧 Your email", key="signin_email").strip()
+    if not st.button("📨 Email me a sign-in link", key="signin_send"):
+        return
+    ss = st.session_state
+    if "@" not in email:
+        st.warning("⚠️ Please enter a valid email address.")
+        return
+    if time.time() - ss.get("signin_sent_at", 0) < SIGNIN_COOLDOWN_S:
+        st.warning("⚠️ A link was just sent. Please wait a minute before asking again.")
+        return
+    body = (f"Open this link to see your FairFight AI cases:\n\n{signin_link(BASE_URL, email)}\n\n"
+            "It expires in 24 hours. If you did not ask for it, you can ignore this email.\n\n🤖 FairFight AI")
+    try:
+        send_mail(email, "Your FairFight AI cases", body)
+    except Exception as e:
+        st.warning(f"⚠️ Could not send the sign-in link: {e}")
+        return
+    ss.signin_sent_at = time.time()
+    st.success("✅ Check your inbox for the sign-in link.")
+
+def my_cases():
+    # Lists every case of a contact, so the contact must be proven first: the
+    # list only opens from a sign-in link mailed to that address. Still a
+    # summary: no case text, verdicts or links (those need each case's link)
+    with st.sidebar:
+        st.subheader("📂 My cases")
+        ss = st.session_state
+        contact = ss.get("history_contact")
+        if not contact:
+            request_signin()
+            return
+        st.caption(f"Signed in as {contact}")
+        if st.button("🚪 Sign out", key="history_signout"):
+            ss.pop("history_contact", None)
+            st.rerun()
+        if ss.get("history_for") != contact:
+            ss.history_for, ss.history_pages, ss.history_next = contact, [None], None
+
+        col1, col2 = st.columns(2)
+        if col1.button("⬅️ Newer", key="history_newer") and len(ss.history_pages) > 1:
+            ss.history_pages.pop()
+        if col2.button("Older ➡️", key="history_older") and ss.history_next:
+            ss.history_pages.append(ss.history_next)
         try:
-            tts = gTTS(text=verdict, lang=lang_code if lang_code else "en")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-                tts.save(fp.name)
-                st.audio(fp.name, format="audio/mp3")
+            with timed("history"):
+                rows, ss.history_next = open_history(PENDING_DB, VERDICTS_DB).page(
+                    contact, cursor=ss.history_pages[-1], limit=10)
         except Exception as e:
-            st.warning(f"🔈 Could not generate speech: {e}")
-
-        # Notify User 1
-        msg = (
-            f"Hello {user1_name},\n\n🎯 The conflict between you and {user2_name} "
-            f"has been analyzed by JudgeBot.\n\nHere is the verdict:\n{verdict}\n\n"
-            f"🤖 FairFight AI – Objective Conflict Resolution"
-        )
-
-        if user1_email:
-            email_link = generate_mailto_link(user1_email, "FairFight AI Verdict", msg)
-            st.markdown(f"[📧 Notify {user1_name} by Email]({email_link})", unsafe_allow_html=True)
+            st.warning(f"⚠️ Could not load your cases: {e}")
+            return
 
-        if user1_phone:
-            whatsapp_link = generate_whatsapp_link(user1_phone, msg)
-            st.markdown(f"[📲 Notify {user1_name} on WhatsApp]({whatsapp_link})", unsafe_allow_html=True)
+        if not rows:
+            st.info("No cases found for this contact.")
+        for r in rows:
+            when = (r["created_at"] or "")[:10]
+            if r["status"] == "decided" and r["user1_pct"] is not None:
+                status = f"⚖️ {r['user1_pct']:g}% – {r['user2_pct']:g}%"
+            elif r["status"] == "decided":
+                status = "✅ Verdict delivered"
+            else:
+                status = "⏳ Waiting for the other side"
+            st.markdown(f"**{r['theme'] or '—'}** · {when}  \n"
+                        f"{r['user1_name'] or '?'} vs {r['user2_name'] or '?'} — {status}")
 
 # ---------- Main ----------
 def main():
@@ -314,14 +476,17 @@ def main():
         keys = [
             "theme", "user1_name", "user2_name", "user1_input",
             "user1_email", "user2_email", "user1_phone", "user2_phone",
-            "token"
+            "token", "c"
         ]
         data = {k: qget(query, k, "") for k in keys}
         step_2(data)
     else:
+        if step == "cases":
+            sign_in(qget(query, "k", ""))
         theme_choice = st.selectbox("Choose a conflict type:", ["Couple 💔", "Friends 🎭", "Pro 👨‍💼"])
         theme = theme_choice.split()[0]  # "Couple" | "Friends" | "Pro"
         step_1(theme)
+        my_cases()
 
 if __name__ == "__main__":
     main()
@@ -1,27 +1,47 @@
 import streamlit as st
-import openai
-import re
-import base64
-import json
 import urllib.parse
-from urllib.parse import urlencode
 from datetime import datetime
-from gtts import gTTS
-import tempfile
-from langdetect import detect
+
+from case_session import case_key, case_state, remember
+from case_store import append_jsonl, open_store
+from judge import Judge
+from language import preload
+from links import decode_payload, legacy_b64_decode, new_token, payload_link, token_link, verify_token
+from llm import make_backend
+from metrics import Trace
+from pipeline import preload_modules, submit
+from verdict_cache import is_error, open_cache
+from verdict_parse import parse_verdict, verdict_fields
+from tts import synthesize
 
 import os
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 
-# ✅ Map language codes to full names for clarity in prompts
-LANG_NAME_MAP = {
-    "en": "English", "fr": "French", "es": "Spanish", "de": "German", "ar": "Arabic",
-    "hi": "Hindi", "zh-cn": "Chinese", "pt": "Portuguese", "ru": "Russian"
-}
+# 🔥 openai, gTTS and the language profiles load on the pool once Step 2 opens
+@st.cache_resource
+def warm_step_2():
+    return [submit(preload), *preload_modules("openai", "gtts")]
+
+BASE_URL = "https://fairfight.streamlit.app"
+PENDING_DB = "pending_cases.jsonl"  # only used for cases too long to travel in the link
+VERDICTS_DB = "verdicts.json"
+
+# 🗄️ Cases too long for a link are kept server-side behind a signed token
+def save_case(case):
+    token = new_token()
+    open_store(PENDING_DB).append({**case, "token": token, "created_at": datetime.utcnow().isoformat()})
+    return token
+
+def load_case(token):
+    if not verify_token(token):
+        return None
+    try:
+        return open_store(PENDING_DB).get(token)
+    except Exception:
+        return None
 
 # ✅ Save verdicts to local JSON file
-def save_verdict(theme, user1_name, user2_name, user1_input, user2_input, verdict, **kwargs):
+def save_verdict(theme, user1_name, user2_name, user1_input, user2_input, verdict, lang=None, cache_key=None, **kwargs):
     record = {
         "timestamp": datetime.utcnow().isoformat(),
         "theme": theme,
@@ -30,13 +50,16 @@ def save_verdict(theme, user1_name, user2_name, user1_input, user2_input, verdic
         "user1_input": user1_input,
         "user2_input": user2_input,
         "verdict": verdict,
+        "lang": lang,
+        "cache_key": cache_key,  # lets the verdict cache find exact repeats
+        **verdict_fields(parse_verdict(verdict, user1_name, user2_name, lang)),
         "meta": kwargs
     }
     try:
-        with open("verdicts.json", "a") as f:
-            f.write(json.dumps(record) + "\n")
+        append_jsonl(VERDICTS_DB, record)
     except Exception as e:
         print("Error saving verdict:", e)
+    open_cache(VERDICTS_DB).remember(cache_key, verdict, lang)
 
 # 📧 Email link
 def generate_mailto_link(email, subject, body):
@@ -50,41 +73,46 @@ def generate_whatsapp_link(phone, msg):
     msg = urllib.parse.quote(msg)
     return f"https://wa.me/{phone}?text={msg}"
 
-# 🧠 Analyze conflict
+# 🧠 JudgeBot: the shared Judge does caching, translation, prompt budget and streaming
+SYSTEM_INSTRUCTION = (
+    "You are JudgeBot, an unbiased AI judge. "
+    "Analyze both sides carefully, highlight key arguments from each party, and give a fair, neutral verdict. "
+    "Clearly state who is more reasonable and provide a win percentage (e.g., 60% vs 40%). "
+    "Respond in the same language as the users."
+)
+
+USER_PROMPT = (
+    "You must respond only in {lang_name}.\n"
+    "Context: {theme} conflict.\n"
+    "{user1_name} says:\n{user1_input}\n\n"
+    "{user2_name} says:\n{user2_input}\n\n"
+    "Please give your verdict in {lang_name}. Who is more reasonable and why? Show the win percentage too."
+)
+
+# 🔌 One Judge (OpenAI backend, HTTP connection pool, verdict cache) per server process
+@st.cache_resource
+def get_judge():
+    backend = make_backend("openai", api_key=os.getenv("OPENAI_API_KEY"))
+    return Judge(backend, VERDICTS_DB, SYSTEM_INSTRUCTION, USER_PROMPT, error_prefix="❌ Error")
+
+def dispute_key(user1_input, user2_input, theme, user1_name, user2_name):
+    return get_judge().dispute_key(user1_input, user2_input, theme, user1_name, user2_name)
+
 def analyze_conflict(user1_input, user2_input, theme, user1_name, user2_name):
-    try:
-        detected_lang = detect(user1_input + " " + user2_input)
-    except:
-        detected_lang = "en"
-
-    lang_name = LANG_NAME_MAP.get(detected_lang, "English")
-
-    system_prompt = (
-        f"You are JudgeBot, an unbiased AI judge for {theme.lower()} conflicts. "
-        f"You must respond only in {lang_name}. "
-        "Analyze both sides carefully, highlight key arguments from each party, and give a fair, neutral verdict. "
-        "Clearly state who is more reasonable and provide a win percentage (e.g., 60% vs 40%)."
-    )
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {
-            "role": "user",
-            "content": f"{user1_name} says:\n{user1_input}\n\n"
-                       f"{user2_name} says:\n{user2_input}\n\n"
-                       f"Please give your verdict in {lang_name}. Who is more reasonable and why? Show the win percentage too.",
-        },
-    ]
+    return get_judge().analyze(user1_input, user2_input, theme, user1_name, user2_name)
 
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-        )
-        return response.choices[0].message.content, detected_lang
-    except Exception as e:
-        return f"❌ Error: {e}", "en"
+# 🌊 Stream the verdict chunk by chunk
+def stream_conflict(user1_input, user2_input, theme, user1_name, user2_name, trace=None):
+    return get_judge().stream(user1_input, user2_input, theme, user1_name, user2_name, trace)
+
+def render_stream(chunks):
+    if hasattr(st, "write_stream"):
+        return st.write_stream(chunks)
+    placeholder, text = st.empty(), ""
+    for chunk in chunks:
+        text += chunk
+        placeholder.markdown(text)
+    return text
 
 # 🔁 Step 1 – User 1 inputs
 def step_1(theme):
@@ -103,22 +131,24 @@ def step_1(theme):
             st.warning("⚠️ Please fill all required fields.")
             return
 
-        encoded_input = base64.urlsafe_b64encode(user1_input.encode()).decode()
-
-        params = urlencode({
-            "step": "2",
+        case = {
             "theme": theme.split()[0],
             "user1_name": user1_name,
             "user2_name": user2_name,
-            "user1_input": encoded_input,
+            "user1_input": user1_input,
             "user1_email": user1_email,
             "user2_email": user2_email,
             "user1_phone": user1_phone,
             "user2_phone": user2_phone,
-        })
-
-        BASE_URL = "https://fairfight.streamlit.app"
-        share_link = f"{BASE_URL}/?{params}"
+        }
+        # Compressed case in the link; long disputes are stored and linked by token
+        share_link = payload_link(BASE_URL, case)
+        if share_link is None:
+            try:
+                share_link = token_link(BASE_URL, save_case(case))
+            except Exception as e:
+                st.error(f"❌ Could not save the case: {e}")
+                return
 
         st.success("✅ Link generated!")
         msg = f"""Hello {user2_name},
@@ -142,33 +172,77 @@ Click to share your version and get JudgeBot's verdict:
             st.markdown(f"[📲 WhatsApp to {user2_name}]({whatsapp_link})", unsafe_allow_html=True)
 
 # 🧾 Step 2 – User 2 responds
+LINK_FIELDS = ["theme", "user1_name", "user2_name", "user1_input", "user1_email", "user2_email", "user1_phone", "user2_phone"]
+
+def resolve_case(data):
+    if data.get("token"):
+        return load_case(data["token"])
+    if data.get("c"):
+        return decode_payload(data["c"])
+    # Links issued before compressed payloads
+    try:
+        return {**data, "user1_input": legacy_b64_decode(data["user1_input"])}
+    except Exception:
+        return None
+
 def step_2(data):
+    warm_step_2()
+    token = data.get("token") or None
+    # 🧠 Case, verdict and audio are kept per session: reruns never repeat I/O or paid calls
+    state = case_state(st.session_state, case_key(data.get("token"), data.get("c"), data.get("user1_input")))
+    data = remember(state, "case", lambda: resolve_case(data))
+    if not data:
+        st.error("❌ The link appears corrupted or has expired. Ask User 1 to resend the link.")
+        return
+    data = {k: data.get(k, "") for k in LINK_FIELDS}
+
     st.subheader(f"2️⃣ {data['theme']} Conflict - Step 2: {data['user2_name']} Responds")
 
-    user1_input_decoded = base64.urlsafe_b64decode(data['user1_input']).decode()
+    user1_input_decoded = data['user1_input']
 
     st.markdown(f"**🧑 {data['user1_name']} said:**")
     st.info(user1_input_decoded)
 
+    if state.get("verdict"):
+        st.success("✅ Verdict delivered!")
+        st.markdown(state["verdict"])
+        notify_user1(data, state["verdict"])
+        if state.get("audio"):
+            st.audio(state["audio"], format="audio/mp3")
+        return
+
     user2_input = st.text_area(f"👩 {data['user2_name']}, your version")
 
     if st.button("🧠 Get Verdict from JudgeBot"):
-        verdict, detected_lang = analyze_conflict(user1_input_decoded, user2_input, data['theme'], data['user1_name'], data['user2_name'])
-        save_verdict(data['theme'], data['user1_name'], data['user2_name'], user1_input_decoded, user2_input, verdict)
-
+        args = (user1_input_decoded, user2_input, data['theme'], data['user1_name'], data['user2_name'])
+        trace = Trace(app="ff", token=token)
+        chunks, detected_lang = stream_conflict(*args, trace=trace)
+        verdict = render_stream(chunks)
+        if chunks.error or is_error(verdict):  # a stream cut off mid-way is not a verdict either
+            st.warning("⚠️ JudgeBot could not deliver a verdict right now. Please try again in a moment.")
+            return
+        speech = submit(synthesize, verdict, detected_lang)
         st.success("✅ Verdict delivered!")
-        st.markdown(verdict)
+        audio_slot = st.empty()
+
+        with trace.stage("save_verdict"):
+            save_verdict(data['theme'], data['user1_name'], data['user2_name'], user1_input_decoded, user2_input, verdict,
+                         lang=detected_lang, cache_key=dispute_key(*args))
+        state.update(verdict=verdict, lang=detected_lang)
+
+        notify_user1(data, verdict)
 
-        try:
-            tts = gTTS(text=verdict, lang=detected_lang)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-                temp_audio_path = fp.name
-                tts.save(temp_audio_path)
-            st.audio(temp_audio_path, format="audio/mp3")
-        except Exception as e:
-            st.warning(f"🔈 Could not generate speech: {e}")
+        with trace.stage("tts_wait"):
+            try:
+                state["audio"] = speech.result()
+                audio_slot.audio(state["audio"], format="audio/mp3")
+            except Exception as e:
+                audio_slot.warning(f"🔈 Could not generate speech: {e}")
+        trace.emit()
 
-        msg = f"""Hello {data['user1_name']},
+# 📣 Links for User 1 to receive the verdict
+def notify_user1(data, verdict):
+    msg = f"""Hello {data['user1_name']},
 
 🎯 The conflict between you and {data['user2_name']} has been analyzed by JudgeBot.
 
@@ -177,13 +251,13 @@ Here is the verdict:
 
 🤖 FairFight AI – Objective Conflict Resolution"""
 
-        if data['user1_email']:
-            email_link = generate_mailto_link(data['user1_email'], "FairFight AI Verdict", msg)
-            st.markdown(f"[📧 Notify {data['user1_name']} by Email]({email_link})", unsafe_allow_html=True)
+    if data['user1_email']:
+        email_link = generate_mailto_link(data['user1_email'], "FairFight AI Verdict", msg)
+        st.markdown(f"[📧 Notify {data['user1_name']} by Email]({email_link})", unsafe_allow_html=True)
 
-        if data['user1_phone']:
-            whatsapp_link = generate_whatsapp_link(data['user1_phone'], msg)
-            st.markdown(f"[📲 Notify {data['user1_name']} on WhatsApp]({whatsapp_link})", unsafe_allow_html=True)
+    if data['user1_phone']:
+        whatsapp_link = generate_whatsapp_link(data['user1_phone'], msg)
+        st.markdown(f"[📲 Notify {data['user1_name']} on WhatsApp]({whatsapp_link})", unsafe_allow_html=True)
 
 # 🏠 Main entry point
 def main():
@@ -192,11 +266,10 @@ def main():
     st.caption("Because every conflict deserves a fair verdict.")
 
     query = st.query_params
-    step = query.get("step", ["1"])[0]
+    step = query.get("step", "1")
 
     if step == "2":
-        keys = ["theme", "user1_name", "user2_name", "user1_input", "user1_email", "user2_email", "user1_phone", "user2_phone"]
-        data = {k: query.get(k, [""])[0] for k in keys}
+        data = {k: query.get(k, "") for k in LINK_FIELDS + ["token", "c"]}
         step_2(data)
     else:
         theme = st.selectbox("Choose a conflict type:", ["Couple 💔", "Friends 🎭", "Pro 👨‍💼"])
@@ -0,0 +1,304 @@
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from case_store import CorruptRecord, decode_record, report_corrupt
+from compaction import verdict_segments
+
+# ---------- Case history index ----------
+# "My cases" needs cases by participant, theme and time without scanning the
+# JSONL logs. HISTORY_DB is a SQLite file (WAL, shared by the replicas on the
+# volume) holding one summary row per case plus one row per participant
+# contact, indexed for newest-first keyset pagination. refresh() reads only
+# the bytes appended to the pending-cases and verdict logs since the last
+# call. A log rewritten by compaction or rotation is re-read in full, along
+# with recently touched verdict segments; upserts make re-reading harmless.
+# Rows outlive compaction, so decided and expired cases stay listed.
+
+HISTORY_DB = os.getenv("HISTORY_DB", "history.sqlite3")
+PAGE_SIZE = 20
+COMMIT_EVERY = 5000  # lines per transaction during a long catch-up scan
+PAGE_REFRESH_LINES = 2000  # most lines a page() call indexes before answering
+HISTORY_REFRESH_S = float(os.getenv("HISTORY_REFRESH_S", "30"))
+SUMMARY_CHARS = 200
+CONTACT_FIELDS = ("user1_email", "user2_email", "user1_phone", "user2_phone")
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id          TEXT PRIMARY KEY,  -- case token, or "verdict:<ts>:<cache key>" for verdicts without one
+    created_at  TEXT NOT NULL,     -- ISO timestamp (UTC)
+    theme       TEXT,
+    user1_name  TEXT,
+    user2_name  TEXT,
+    status      TEXT NOT NULL,     -- pending | decided
+    verdict_at  TEXT,
+    winner      INTEGER,
+    user1_pct   REAL,
+    user2_pct   REAL,
+    summary     TEXT
+);
+CREATE INDEX IF NOT EXISTS cases_created ON cases (created_at, id);
+CREATE INDEX IF NOT EXISTS cases_theme_created ON cases (theme, created_at, id);
+CREATE TABLE IF NOT EXISTS participants (
+    contact     TEXT NOT NULL,     -- "email:<lowercase>" or "tel:<digits>"
+    id          TEXT NOT NULL,
+    role        TEXT NOT NULL,     -- user1 | user2
+    created_at  TEXT NOT NULL,     -- copy of cases.created_at, for the index below
+    PRIMARY KEY (contact, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS participants_contact_created ON participants (contact, created_at, id);
+CREATE INDEX IF NOT EXISTS participants_id ON participants (id);
+CREATE TABLE IF NOT EXISTS sources (
+    path        TEXT PRIMARY KEY,
+    inode       INTEGER,
+    offset      INTEGER NOT NULL,
+    refreshed   REAL NOT NULL
+);
+"""
+
+_UPSERT_CASE = """
+INSERT INTO cases (id, created_at, theme, user1_name, user2_name, status, verdict_at, winner, user1_pct, user2_pct, summary)
+VALUES (:id, :created_at, :theme, :user1_name, :user2_name, :status, :verdict_at, :winner, :user1_pct, :user2_pct, :summary)
+ON CONFLICT(id) DO UPDATE SET
+    created_at = min(cases.created_at, excluded.created_at),
+    theme = coalesce(cases.theme, excluded.theme),
+    user1_name = coalesce(cases.user1_name, excluded.user1_name),
+    user2_name = coalesce(cases.user2_name, excluded.user2_name),
+    status = CASE WHEN excluded.status = 'decided' THEN 'decided' ELSE cases.status END,
+    verdict_at = coalesce(excluded.verdict_at, cases.verdict_at),
+    winner = coalesce(excluded.winner, cases.winner),
+    user1_pct = coalesce(excluded.user1_pct, cases.user1_pct),
+    user2_pct = coalesce(excluded.user2_pct, cases.user2_pct),
+    summary = coalesce(excluded.summary, cases.summary)
+"""
+
+
+# ---------- Contacts and cursors ----------
+def normalize_contact(value: str) -> str | None:
+    """"email:<lowercase>" or "tel:<digits>", so "+33 6 12-34" and "33612 34" match."""
+    value = (value or "").strip()
+    if "@" in value:
+        return f"email:{value.casefold()}"
+    digits = re.sub(r"\D", "", value)
+    return f"tel:{digits}" if len(digits) >= 6 else None
+
+
+def encode_cursor(created_at: str, ident) -> str:
+    raw = json.dumps([created_at, ident], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str | None):
+    """(created_at, id) of the last row of the previous page, or None."""
+    if not cursor:
+        return None
+    try:
+        created_at, ident = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("invalid history cursor") from None
+    return created_at, ident
+
+
+def _case_row(rec: dict, kind: str) -> dict | None:
+    ts = rec.get("created_at") or rec.get("timestamp")
+    token = rec.get("token")
+    if not ts or (kind == "case" and not token):
+        return None
+    decided = kind == "verdict"
+    return {
+        "id": token or f"verdict:{ts}:{rec.get('cache_key') or ''}",
+        "created_at": ts,
+        "theme": rec.get("theme"),
+        "user1_name": rec.get("user1_name"),
+        "user2_name": rec.get("user2_name"),
+        "status": "decided" if decided else "pending",
+        "verdict_at": ts if decided else None,
+        "winner": rec.get("winner") if decided else None,
+        "user1_pct": rec.get("user1_pct") if decided else None,
+        "user2_pct": rec.get("user2_pct") if decided else None,
+        "summary": (rec.get("verdict") or "")[:SUMMARY_CHARS] or None if decided else None,
+    }
+
+
+def _contacts(rec: dict):
+    meta = rec.get("meta") if isinstance(rec.get("meta"), dict) else {}
+    for field in CONTACT_FIELDS:
+        contact = normalize_contact(rec.get(field) or meta.get(field))
+        if contact:
+            yield contact, field.split("_")[0]
+
+
+# ---------- Index ----------
+class HistoryIndex:
+    def __init__(self, sources, path: str = HISTORY_DB):
+        """sources: [(jsonl path, "case" | "verdict"), ...]"""
+        self.sources = list(sources)
+        self.path = path
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conn(self, timeout: float = 30):
+        conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL: durable at checkpoints, enough for a rebuildable index
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _add(self, conn, rec: dict, kind: str):
+        row = _case_row(rec, kind)
+        if row is None:
+            return
+        before = conn.execute("SELECT created_at FROM cases WHERE id = ?", (row["id"],)).fetchone()
+        conn.execute(_UPSERT_CASE, row)
+        created_at = min(before[0], row["created_at"]) if before else row["created_at"]
+        if before and created_at != before[0]:
+            # the case turned out older than first seen (verdict indexed before its case)
+            conn.execute("UPDATE participants SET created_at = ? WHERE id = ?", (created_at, row["id"]))
+        for contact, role in _contacts(rec):
+            conn.execute("INSERT OR IGNORE INTO participants (contact, id, role, created_at) VALUES (?, ?, ?, ?)",
+                         (contact, row["id"], role, created_at))
+
+    def _scan(self, conn, path: str, kind: str, offset: int = 0, source: str | None = None,
+              max_lines: int | None = None):
+        """Index complete lines from `offset`; commits every COMMIT_EVERY lines. Returns the end offset."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for n, raw in enumerate(f, start=1):
+                if not raw.endswith(b"\n") or (max_lines and n > max_lines):
+                    break  # partial line from a writer still in progress, or out of budget
+                start, offset = offset, offset + len(raw)
+                if raw.strip():
+                    try:
+                        self._add(conn, decode_record(raw), kind)
+                    except CorruptRecord as e:
+                        report_corrupt(path, start, e)
+                if source and n % COMMIT_EVERY == 0:
+                    conn.execute("UPDATE sources SET offset = ? WHERE path = ?", (offset, source))
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN IMMEDIATE")
+        return offset
+
+    def _refresh_source(self, conn, path: str, kind: str, max_lines: int | None = None):
+        key = os.path.abspath(path)
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            return
+        row = conn.execute("SELECT inode, offset, refreshed FROM sources WHERE path = ?", (key,)).fetchone()
+        inode, offset, refreshed = row if row else (None, 0, 0.0)
+        if inode == info.st_ino and offset == info.st_size:
+            return
+        now = time.time()
+        if inode != info.st_ino or info.st_size < offset:
+            offset = 0  # rewritten by compaction: read it again from the start
+            if kind == "verdict":
+                # rotation may have moved lines we had not read yet into a segment
+                for segment in verdict_segments(path)[:-1]:
+                    if os.path.getmtime(segment) >= refreshed - 60:
+                        self._scan(conn, segment, kind)
+        conn.execute("INSERT INTO sources (path, inode, offset, refreshed) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(path) DO UPDATE SET inode = excluded.inode, offset = excluded.offset",
+                     (key, info.st_ino, offset, refreshed))
+        offset = self._scan(conn, path, kind, offset, source=key, max_lines=max_lines)
+        conn.execute("UPDATE sources SET offset = ?, refreshed = ? WHERE path = ?", (offset, now, key))
+
+    def refresh(self, timeout: float = 30, max_lines: int | None = None):
+        """Index what was appended (or rewritten) since the last refresh, in any process."""
+        with self._conn(timeout) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for path, kind in self.sources:
+                    self._refresh_source(conn, path, kind, max_lines)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def page(self, contact: str | None = None, theme: str | None = None, since: str | None = None,
+             until: str | None = None, cursor: str | None = None, limit: int = PAGE_SIZE):
+        """
+        Newest first: (rows, next cursor or None). Filter by participant
+        contact (email or phone, as typed), theme and/or ISO time range.
+        Callers must have verified the contact (links.verify_signin) first.
+        """
+        try:
+            # bounded: a long catch-up (first run, after compaction) is left to the background refresh
+            self.refresh(timeout=1, max_lines=PAGE_REFRESH_LINES)
+        except sqlite3.OperationalError:
+            pass  # another process is catching up; serve what is indexed
+        if contact:
+            key = normalize_contact(contact)
+            if key is None:
+                return [], None
+            table, where, params = "participants p JOIN cases c ON c.id = p.id", ["p.contact = ?"], [key]
+            order = "p.created_at"
+        else:
+            table, where, params, order = "cases c", [], [], "c.created_at"
+        if theme:
+            where.append("c.theme = ?")
+            params.append(theme)
+        if since:
+            where.append(f"{order} >= ?")
+            params.append(since)
+        if until:
+            where.append(f"{order} < ?")
+            params.append(until)
+        after = decode_cursor(cursor)
+        if after:
+            where.append(f"({order}, c.id) < (?, ?)")
+            params.extend(after)
+        sql = (f"SELECT c.* FROM {table} {'WHERE ' + ' AND '.join(where) if where else ''} "
+               f"ORDER BY {order} DESC, c.id DESC LIMIT ?")
+        with self._conn() as conn:
+            rows = [dict(r) for r in conn.execute(sql, (*params, limit + 1))]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if more else None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_history(pending_path: str, verdicts_path: str, path: str = HISTORY_DB) -> HistoryIndex:
+    key = (os.path.abspath(pending_path), os.path.abspath(verdicts_path), os.path.abspath(path))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = HistoryIndex([(pending_path, "case"), (verdicts_path, "verdict")], path)
+        return index
+
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def start_background_refresh(index: HistoryIndex, interval_s: float = HISTORY_REFRESH_S):
+    """Start a daemon thread (once per process and index) that keeps the index caught up."""
+    key = os.path.abspath(index.path)
+    with _started_lock:
+        if key in _started:
+            return
+        _started.add(key)
+
+    def loop():
+        while True:
+            try:
+                index.refresh()
+            except Exception as e:
+                log.exception("History index error: %s", e)
+            time.sleep(interval_s)
+
+    threading.Thread(target=loop, name="history-index", daemon=True).start()
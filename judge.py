@@ -0,0 +1,128 @@
+import language
+from llm import GuardedStream
+from metrics import incr, timed, timed_stream
+from pipeline import submit
+from prompt_budget import fit_inputs
+from translation import prewarm, translate_instruction
+from verdict_cache import open_cache, verdict_key
+from verdict_parse import STRUCTURED_INSTRUCTION, parse_verdict, verdict_fields
+
+# ---------- JudgeBot core ----------
+# Shared by fairfight.py, judgeit.py and ff.py: each app only picks its backend
+# and prompt wording; caching, translation and streaming live here. The user
+# prompt may use {lang_name} (e.g. "French") to pin the answer's language,
+# which does not depend on the system instruction's translation being ready.
+
+SYSTEM_INSTRUCTION = (
+    "You are JudgeBot, an impartial AI judge. Analyze both sides carefully, "
+    "highlight key arguments from each, and give a fair verdict. Clearly state "
+    "who is more reasonable, and give a win percentage (e.g., 60% vs 40%). "
+    "Respond in the same language as the users."
+)
+
+USER_PROMPT = (
+    "Context: {theme} conflict.\n"
+    "{user1_name} says: {user1_input}\n\n"
+    "{user2_name} says: {user2_input}\n\n"
+    "Provide a final verdict and the win percentage."
+)
+
+
+def detect_language(user1_input, user2_input) -> str:
+    try:
+        return language.detect_language(user1_input, user2_input)
+    except Exception:
+        return "en"
+
+
+class Judge:
+    def __init__(self, backend, verdicts_path, system_instruction=SYSTEM_INSTRUCTION,
+                 user_prompt=USER_PROMPT, error_prefix="❌ AI Error"):
+        self.backend = backend
+        self.verdicts_path = verdicts_path
+        self.system_instruction = system_instruction
+        self.user_prompt = user_prompt
+        self.error_prefix = error_prefix
+        prewarm(system_instruction)
+        submit(language.preload)  # profiles load off the request path
+
+    def build_messages(self, user1_input, user2_input, theme, user1_name, user2_name, trace=None):
+        with timed("detect", trace):
+            lang_code = detect_language(user1_input, user2_input)
+
+        # Translate on the shared pool while the user prompt is assembled
+        translated = submit(translate_instruction, self.system_instruction, lang_code)
+        with timed("budget", trace):
+            (user1_input, user2_input), budget = fit_inputs([user1_input, user2_input], model=self.backend.model)
+        if trace is not None and budget["saved"]:
+            trace.labels.update(prompt_tokens=budget["tokens_out"], prompt_tokens_saved=budget["saved"])
+        user_prompt = self.user_prompt.format(
+            theme=theme, user1_name=user1_name, user2_name=user2_name,
+            user1_input=user1_input, user2_input=user2_input,
+            lang_name=language.language_name(lang_code),
+        )
+
+        with timed("translate", trace):
+            system_instruction = translated.result()
+
+        messages = [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": user_prompt},
+        ]
+        return messages, lang_code
+
+    def dispute_key(self, user1_input, user2_input, theme, user1_name, user2_name):
+        return verdict_key(theme, user1_name, user2_name, user1_input, user2_input,
+                           self.backend.model, self.backend.temperature)
+
+    def analyze(self, user1_input, user2_input, theme, user1_name, user2_name, structured=False):
+        """
+        (verdict, lang_code); errors come back as an error string, never raised.
+        With structured=True: a verdict_parse.parse_verdict() dict instead
+        (winner, percentages, key arguments, lang), asking the backend for
+        JSON when it supports it.
+        """
+        key = self.dispute_key(user1_input, user2_input, theme, user1_name, user2_name)
+        cache = open_cache(self.verdicts_path)
+        cached = cache.get(key, with_fields=True)
+        if cached:
+            incr("verdict_cache_hits_total")
+            verdict, lang_code, fields = cached
+            if not structured:
+                return verdict, lang_code
+            if fields:  # judged with structured output before: keep its key arguments
+                return {"verdict": verdict, **fields, "lang": lang_code}
+            return parse_verdict(verdict, user1_name, user2_name, lang_code)
+        incr("verdict_cache_misses_total")
+        try:
+            messages, lang_code = self.build_messages(user1_input, user2_input, theme, user1_name, user2_name)
+            if structured:
+                messages[0]["content"] += (
+                    f"\n\n{STRUCTURED_INSTRUCTION} user1 is {user1_name}, user2 is {user2_name}."
+                )
+            with timed("llm"):
+                verdict = self.backend.complete(messages, json_mode=structured)
+            if structured:
+                result = parse_verdict(verdict, user1_name, user2_name, lang_code)
+                cache.remember(key, result["verdict"], lang_code, verdict_fields(result))
+                return result
+            cache.remember(key, verdict, lang_code)
+            return verdict, lang_code
+        except Exception as e:
+            error = f"{self.error_prefix}: {e}"
+            return parse_verdict(error, lang="en") if structured else (error, "en")
+
+    def stream(self, user1_input, user2_input, theme, user1_name, user2_name, trace=None):
+        """Same as analyze, but returns (GuardedStream of text chunks, lang_code); check .error once consumed."""
+        key = self.dispute_key(user1_input, user2_input, theme, user1_name, user2_name)
+        cached = open_cache(self.verdicts_path).get(key)
+        if cached:
+            incr("verdict_cache_hits_total")
+            return GuardedStream(iter([cached[0]])), cached[1]
+        incr("verdict_cache_misses_total")
+        try:
+            messages, lang_code = self.build_messages(user1_input, user2_input, theme, user1_name, user2_name, trace)
+        except Exception as e:
+            return GuardedStream(iter(()), error=f"{self.error_prefix}: {e}"), "en"
+        chunks = timed_stream(self.backend.stream(messages), "llm", trace)
+        return GuardedStream(chunks, self.error_prefix), lang_code
@@ -1,98 +1,93 @@
 import streamlit as st
-from openai import OpenAI
-import re
-import base64
-import json
 import urllib.parse
 from datetime import datetime
-from gtts import gTTS
-import tempfile
-from langdetect import detect, DetectorFactory
-from deep_translator import GoogleTranslator
-import uuid
 import os
+import time
+
+from case_session import case_state, remember
+from case_store import append_jsonl, iter_jsonl, open_store
+from compaction import start_background_compaction
+from judge import Judge
+from links import new_token, token_link, verify_token
+from llm import make_backend
+from metrics import Trace, observe, start_metrics_server, timed
+from pipeline import preload_modules, submit
+from tts import synthesize
+from verdict_cache import verdict_for_token
+from verdict_jobs import DONE, FAILED, JOB_POLL_S, QUEUED, RUNNING, open_queue, start_workers
 
 # ---------- Streamlit page config ----------
 st.set_page_config(page_title="FairFight AI", page_icon="⚖️", layout="centered")
 
-# ---------- Deterministic language detection ----------
-DetectorFactory.seed = 0
-
-# ---------- DeepSeek Setup (Modern OpenAI v1.x Syntax) ----------
 # ---------- API Setup ----------
 DEEPSEEK_API_KEY = st.secrets.get("DEEPSEEK_API_KEY") or os.getenv("DEEPSEEK_API_KEY")
 
-if not DEEPSEEK_API_KEY:
+if not DEEPSEEK_API_KEY and os.getenv("LLM_BACKEND") != "stub":
     st.error("❌ API key missing (Streamlit secrets or environment variable)")
     st.stop()
 
-client = OpenAI(
-    api_key=DEEPSEEK_API_KEY,
-    base_url="https://api.deepseek.com/v1"
-)
-
 # ---------- Constants ----------
 BASE_URL = "https://fairfight.streamlit.app"
 PENDING_DB = "pending_cases.jsonl"   
 VERDICTS_DB = "verdicts.jsonl"       
-
-# ---------- Helpers: robust Base64 (URL-safe) ----------
-def b64url_decode(s: str) -> str:
-    if not s:
-        return ""
-    s = s.replace(" ", "+") 
-    pad_len = (4 - len(s) % 4) % 4
-    s += "=" * pad_len
-    try:
-        return base64.urlsafe_b64decode(s.encode("utf-8")).decode("utf-8")
-    except:
-        return ""
+PERSIST_TO_POSTGRES = bool(st.secrets.get("DB_HOST") or os.getenv("DB_HOST"))
+
+# ---------- Process-wide startup (once per server process, not per rerun) ----------
+@st.cache_resource
+def start_services():
+    # Index existing cases (migrates a pre-existing JSONL)
+    open_store(PENDING_DB)
+    # Drop resolved/expired cases and rotate the verdict log off the request path
+    start_background_compaction(PENDING_DB, VERDICTS_DB)
+    # Prometheus text on http://127.0.0.1:$METRICS_PORT/metrics when METRICS_PORT is set
+    start_metrics_server()
+    # Verdicts are produced by worker processes fed from a durable job queue
+    start_workers("deepseek", VERDICTS_DB, api_key=DEEPSEEK_API_KEY, to_postgres=PERSIST_TO_POSTGRES)
+    return True
+
+@st.cache_resource
+def warm_step_2():
+    # The LLM runs in the workers; the page only needs gTTS for the audio
+    return preload_modules("gtts")
+
+start_services()
 
 # ---------- Persistence: append-only JSONL ----------
 def _append_jsonl(path: str, record: dict):
     try:
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        append_jsonl(path, record)
     except Exception as e:
         st.warning(f"⚠️ Persistence error: {e}")
 
 def _iter_jsonl(path: str):
-    if not os.path.exists(path):
-        return
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line: continue
-            try:
-                yield json.loads(line)
-            except: continue
+    return iter_jsonl(path)
 
 def save_case(payload: dict) -> str:
-    token = uuid.uuid4().hex
+    token = new_token()
     record = dict(payload)
     record["token"] = token
     record["created_at"] = datetime.utcnow().isoformat()
-    _append_jsonl(PENDING_DB, record)
+    try:
+        open_store(PENDING_DB).append(record)
+    except Exception as e:
+        st.warning(f"⚠️ Persistence error: {e}")
     return token
 
 def load_case(token: str) -> dict | None:
-    for rec in _iter_jsonl(PENDING_DB):
-        if rec.get("token") == token:
-            return rec
-    return None
-
-def save_verdict(theme, u1n, u2n, u1i, u2i, verdict, token):
-    record = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "token": token,
-        "theme": theme,
-        "user1_name": u1n,
-        "user2_name": u2n,
-        "user1_input": u1i,
-        "user2_input": u2i,
-        "verdict": verdict,
-    }
-    _append_jsonl(VERDICTS_DB, record)
+    if not verify_token(token):
+        return None  # forged or mangled link: no disk I/O
+    try:
+        with timed("load_case"):
+            return open_store(PENDING_DB).get(token)
+    except Exception:
+        return None
+
+def enqueue_verdict(token, theme, u1n, u2n, u1i, u2i):
+    # The worker persists the verdict (verdict_jobs.process_job), which resolves the case
+    open_queue().enqueue(token, {
+        "theme": theme, "user1_name": u1n, "user2_name": u2n,
+        "user1_input": u1i, "user2_input": u2i,
+    })
 
 # ---------- Link helpers ----------
 def generate_mailto_link(email, subject, body):
@@ -103,44 +98,55 @@ def generate_whatsapp_link(phone, msg):
     return f"https://wa.me/{phone}?text={urllib.parse.quote(msg)}"
 
 # ---------- JudgeBot core (DeepSeek) ----------
-def analyze_conflict(user1_input, user2_input, theme, user1_name, user2_name):
+@st.cache_resource
+def get_judge():
+    # One backend (and HTTP connection pool) per server process, reused across reruns
+    return Judge(make_backend("deepseek", api_key=DEEPSEEK_API_KEY), VERDICTS_DB)
+
+def analyze_conflict(user1_input, user2_input, theme, user1_name, user2_name, structured=False):
+    return get_judge().analyze(user1_input, user2_input, theme, user1_name, user2_name, structured)
+
+def show_verdict(state, trace=None):
+    """The verdict and its audio; synthesized once, then replayed from the session."""
+    st.divider()
+    st.markdown("## 📜 The Verdict")
+    st.write(state["verdict"])
+
+    # Text to Speech
     try:
-        text_for_lang = (user1_input or "") + " " + (user2_input or "")
-        try:
-            lang_code = detect(text_for_lang.strip() or "en")
-        except:
-            lang_code = "en"
-
-        system_instruction = (
-            "You are JudgeBot, an impartial AI judge. Analyze both sides carefully, "
-            "highlight key arguments from each, and give a fair verdict. Clearly state "
-            "who is more reasonable, and give a win percentage (e.g., 60% vs 40%). "
-            "Respond in the same language as the users."
-        )
-
-        try:
-            # Translating instructions to match user language for better prompt adherence
-            system_instruction = GoogleTranslator(source="en", target=lang_code).translate(system_instruction)
-        except: pass
-
-        user_prompt = (
-            f"Context: {theme} conflict.\n"
-            f"{user1_name} says: {user1_input}\n\n"
-            f"{user2_name} says: {user2_input}\n\n"
-            "Provide a final verdict and the win percentage."
-        )
-
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content, lang_code
-    except Exception as e:
-        return f"❌ AI Error: {e}", "en"
+        if state.get("audio") is None:
+            with timed("tts_wait", trace):
+                state["audio"] = submit(synthesize, state["verdict"], state["lang"]).result()
+        st.audio(state["audio"], format="audio/mp3")
+    except Exception:
+        pass
+
+def show_verdict_when_ready(token, trace, state):
+    """
+    Wait for the verdict job without holding the script thread: a fragment
+    re-runs every JOB_POLL_S to check the job row, and once it has finished a
+    full rerun lets step_2 draw the verdict (or the retry form). The verdict
+    is written by a worker process, so it appears whole rather than streamed.
+    """
+    state["trace"] = trace
+
+    def poll():
+        job = open_queue().get(token)
+        if job is not None and job["status"] == DONE:
+            elapsed = time.perf_counter() - trace.started
+            observe("job_wait", elapsed)
+            trace.mark("job_wait", elapsed)
+            state.update(verdict=job["verdict"], lang=job["lang"])
+        if job is None or job["status"] in (DONE, FAILED):
+            st.rerun()
+        st.info("⏳ JudgeBot is deliberating...")
+
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is None:  # older Streamlit: one poll per full rerun
+        poll()
+        time.sleep(JOB_POLL_S)
+        st.rerun()
+    fragment(run_every=JOB_POLL_S)(poll)()
 
 # ---------- UI Sections ----------
 def step_1(theme):
@@ -167,7 +173,7 @@ def step_1(theme):
             "user2_name": u2n, "user2_email": u2e, "user2_phone": u2p, "user1_input": u1i,
         })
 
-        share_link = f"{BASE_URL}/?step=2&token={token}"
+        share_link = token_link(BASE_URL, token)
         st.success("✅ Case Created! Send this link to your opponent:")
         st.code(share_link)
 
@@ -178,7 +184,29 @@ def step_1(theme):
         if u2p: c2.markdown(f"[💬 WhatsApp Opponent]({generate_whatsapp_link(u2p, msg)})", unsafe_allow_html=True)
 
 def step_2(token):
-    record = load_case(token)
+    warm_step_2()
+    # Case, verdict and audio are kept per session: reruns redraw without I/O or paid calls
+    state = case_state(st.session_state, token)
+
+    # Already judged? Looked up before the case itself: compaction drops a case
+    # once it has a verdict, and the verdict record carries the case fields.
+    # The verdict log is read once per session; after that a verdict can only
+    # come from this case's job, so reruns re-read just the job row.
+    job = None
+    if not state.get("verdict") and verify_token(token):
+        previous = None
+        if not state.get("verdict_checked"):
+            state["verdict_checked"] = True
+            previous = verdict_for_token(VERDICTS_DB, token)
+        if previous is None:
+            job = open_queue().get(token)
+            previous = job if job and job["status"] == DONE else None
+        if previous:
+            state.update(verdict=previous["verdict"], lang=previous.get("lang"), earlier=True)
+            if state.get("record") is None:
+                state["record"] = previous.get("payload") or previous
+
+    record = remember(state, "record", lambda: load_case(token))
     if not record:
         st.error("❌ Case not found or link expired.")
         return
@@ -190,30 +218,44 @@ def step_2(token):
     st.markdown(f"### 🧑 **{u1n}'s Version:**")
     st.info(u1i)
 
+    # Delivered in this session (the first time, the trace of the request is finished here)
+    if state.get("verdict") and not state.get("earlier"):
+        st.markdown(f"### 👩 **{u2n}, it's your turn:**")
+        trace = state.pop("trace", None)
+        show_verdict(state, trace)
+        if trace is not None:
+            trace.emit()
+        return
+
+    # Already judged: show the stored verdict instead of paying for another call
+    if state.get("earlier"):
+        st.success("✅ This case has already been judged.")
+        st.divider()
+        st.markdown("## 📜 The Verdict")
+        st.write(state["verdict"])
+        return
+
     st.markdown(f"### 👩 **{u2n}, it's your turn:**")
+
+    # Submitted earlier (e.g. the page was refreshed mid-call): keep waiting on the same job
+    if job and job["status"] in (QUEUED, RUNNING):
+        st.info("⏳ Your version has been received.")
+        show_verdict_when_ready(token, Trace(app="judgeit", token=token), state)
+        return
+
     u2i = st.text_area("📝 Describe your version of events", height=150)
+    if job and job["status"] == FAILED:
+        st.warning("⚠️ The last attempt to reach JudgeBot failed. You can try again.")
 
     if st.button("⚖️ Get Final Verdict"):
         if not u2i.strip():
             st.warning("⚠️ You must enter your version to receive a verdict.")
             return
 
-        with st.spinner("JudgeBot is deliberating..."):
-            verdict, lang = analyze_conflict(u1i, u2i, theme, u1n, u2n)
-            save_verdict(theme, u1n, u2n, u1i, u2i, verdict, token)
-
-            st.divider()
-            st.markdown("## 📜 The Verdict")
-            st.write(verdict)
-
-            # Text to Speech
-            try:
-                tts = gTTS(text=verdict, lang=lang)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-                    tts.save(fp.name)
-                    st.audio(fp.name, format="audio/mp3")
-            except Exception:
-                pass
+        trace = Trace(app="judgeit", token=token)
+        with trace.stage("enqueue"):
+            enqueue_verdict(token, theme, u1n, u2n, u1i, u2i)
+        show_verdict_when_ready(token, trace, state)
 
 def main():
     st.title("🤖 FairFight AI")
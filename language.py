@@ -0,0 +1,93 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import incr
+from translation import LANG_NAME_MAP
+
+# ---------- Language detection ----------
+# langdetect reads its ~50 profiles from disk on the first call; preload()
+# does that once per process (the apps call it at startup on the pipeline
+# pool). Each side of the dispute is detected on a bounded sample instead of
+# the full concatenation, and per-sample probabilities are cached by hash.
+# When both sides agree with high confidence that answer is used directly;
+# otherwise the probabilities are combined, weighted by sample length.
+
+LANG_SAMPLE_CHARS = int(os.getenv("LANG_SAMPLE_CHARS", "300"))
+CONFIDENT = 0.9
+CACHE_SIZE = 4096
+
+_factory = None
+_factory_lock = threading.Lock()
+_cache = OrderedDict()  # sha1(sample) -> [(lang, prob), ...]
+_cache_lock = threading.Lock()
+
+
+def preload():
+    """Load the detector profiles (idempotent)."""
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            from langdetect import DetectorFactory, detector_factory
+
+            DetectorFactory.seed = 0  # deterministic sampling inside langdetect
+            detector_factory.init_factory()
+            _factory = detector_factory._factory
+    return _factory
+
+
+def _sample(text: str) -> str:
+    text = " ".join((text or "").split())
+    if len(text) <= LANG_SAMPLE_CHARS:
+        return text
+    cut = text.rfind(" ", 0, LANG_SAMPLE_CHARS)
+    return text[:cut if cut > 0 else LANG_SAMPLE_CHARS]
+
+
+def _probabilities(sample: str) -> list[tuple[str, float]]:
+    key = hashlib.sha1(sample.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            incr("lang_cache_hits_total")
+            return hit
+    incr("lang_cache_misses_total")
+
+    from langdetect.lang_detect_exception import LangDetectException
+
+    try:
+        detector = preload().create()
+        detector.append(sample)
+        probs = [(p.lang, p.prob) for p in detector.get_probabilities()]
+    except LangDetectException:  # no letters to go on (digits, emoji...)
+        probs = []
+    with _cache_lock:
+        _cache[key] = probs
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return probs
+
+
+def detect_language(*texts) -> str:
+    """Language code for the texts taken together ("en" when unsure)."""
+    results = [(len(s), _probabilities(s)) for s in map(_sample, texts) if s]
+    results = [(n, probs) for n, probs in results if probs]
+    if not results:
+        return "en"
+    tops = {probs[0][0] for _, probs in results}
+    if len(tops) == 1 and all(probs[0][1] >= CONFIDENT for _, probs in results):
+        return tops.pop()
+
+    incr("lang_ambiguous_total")
+    scores = {}
+    for n, probs in results:
+        for lang, prob in probs:
+            scores[lang] = scores.get(lang, 0.0) + n * prob
+    return max(scores, key=scores.get)
+
+
+def language_name(lang_code: str) -> str:
+    """Full language name for prompts, e.g. "fr" -> "French"."""
+    return LANG_NAME_MAP.get(lang_code, "English")
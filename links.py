@@ -0,0 +1,162 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+# ---------- Share links ----------
+# The Step-2 link normally carries only a short signed token
+# ("<16-char id>.<12-char HMAC>") pointing at the case on the server. A forged
+# or mistyped token is rejected before any store lookup. Store-less
+# deployments can put the case itself in the link instead: compact JSON,
+# zlib, base64url and a signature. Such a link is only used while it stays
+# under LINK_MAX_CHARS (mail and WhatsApp clients truncate long URLs);
+# beyond that the caller stores the case and sends a token link.
+#
+# "My cases" lists every case of a contact, so it only opens from a sign-in
+# link mailed to that contact: the contact and an expiry, signed the same way.
+
+LINK_SECRET_FILE = os.getenv("LINK_SECRET_FILE", ".link_secret")
+LINK_MAX_CHARS = int(os.getenv("LINK_MAX_CHARS", "1500"))
+MAX_PAYLOAD_BYTES = 64 * 1024
+SIGNIN_TTL_S = int(os.getenv("SIGNIN_TTL_S", str(24 * 3600)))
+SIG_BYTES = 9
+
+_LEGACY_TOKEN = re.compile(r"[0-9a-f]{32}")  # uuid4().hex, issued before tokens were signed
+
+_secret = None
+_secret_lock = threading.Lock()
+
+
+def _load_or_create_secret(path: str) -> bytes:
+    # Shared by every replica on the volume, so links verify on any of them.
+    # The key is written in full to a temp file and hard-linked into place, so
+    # a replica racing us either fails the link or reads the complete key.
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32).encode()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".link_secret.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                return f.read().strip()
+    finally:
+        os.unlink(tmp)
+    return secret
+
+
+def _key() -> bytes:
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            env = os.getenv("LINK_SECRET")
+            _secret = env.encode("utf-8") if env else _load_or_create_secret(LINK_SECRET_FILE)
+        return _secret
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def _sign(value: str) -> str:
+    return _b64(hmac.new(_key(), value.encode("utf-8"), hashlib.sha256).digest()[:SIG_BYTES])
+
+
+# ---------- Tokens ----------
+def new_token() -> str:
+    ident = _b64(secrets.token_bytes(12))
+    return f"{ident}.{_sign(ident)}"
+
+
+def verify_token(token: str) -> bool:
+    if not token:
+        return False
+    ident, dot, sig = token.partition(".")
+    if not dot:
+        return bool(_LEGACY_TOKEN.fullmatch(token))
+    return hmac.compare_digest(sig, _sign(ident))
+
+
+# ---------- Compressed payloads ----------
+def encode_payload(payload: dict) -> str:
+    raw = json.dumps({k: v for k, v in payload.items() if v}, ensure_ascii=False, separators=(",", ":"))
+    body = _b64(zlib.compress(raw.encode("utf-8"), 9))
+    return f"{body}.{_sign(body)}"
+
+
+def decode_payload(value: str) -> dict | None:
+    """The case dict, or None if the value is truncated, tampered with or oversized."""
+    body, dot, sig = (value or "").partition(".")
+    if not dot or not hmac.compare_digest(sig, _sign(body)):
+        return None
+    try:
+        inflater = zlib.decompressobj()
+        raw = inflater.decompress(_unb64(body), MAX_PAYLOAD_BYTES)
+        if inflater.unconsumed_tail:
+            return None
+        payload = json.loads(raw)
+    except (binascii.Error, zlib.error, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+# ---------- Contact sign-in ----------
+def signin_code(contact: str, ttl_s: int = SIGNIN_TTL_S) -> str:
+    body = _b64(json.dumps([contact, int(time.time() + ttl_s)], separators=(",", ":")).encode("utf-8"))
+    return f"{body}.{_sign('signin:' + body)}"  # prefixed: never valid as a token or payload
+
+
+def verify_signin(value: str) -> str | None:
+    """The signed-in contact, or None if the code is forged, mangled or expired."""
+    body, dot, sig = (value or "").partition(".")
+    if not dot or not hmac.compare_digest(sig, _sign("signin:" + body)):
+        return None
+    try:
+        contact, expires = json.loads(_unb64(body))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    return contact if isinstance(contact, str) and expires >= time.time() else None
+
+
+def legacy_b64_decode(s: str) -> str:
+    """user1_input from links issued before compressed payloads (plain base64url)."""
+    if not s:
+        return ""
+    s = s.replace(" ", "+")  # guard against clients turning + into space
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4)).decode("utf-8")
+
+
+# ---------- Links ----------
+def token_link(base_url: str, token: str) -> str:
+    return f"{base_url}/?{urlencode({'step': '2', 'token': token})}"
+
+
+def signin_link(base_url: str, contact: str) -> str:
+    return f"{base_url}/?{urlencode({'step': 'cases', 'k': signin_code(contact)})}"
+
+
+def payload_link(base_url: str, payload: dict, max_chars: int = LINK_MAX_CHARS) -> str | None:
+    """A self-contained Step-2 link, or None when it would exceed max_chars."""
+    link = f"{base_url}/?{urlencode({'step': '2', 'c': encode_payload(payload)})}"
+    return link if len(link) <= max_chars else None
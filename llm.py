@@ -0,0 +1,445 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from metrics import incr
+from rate_limit import breaker_for, is_retryable, limiter_for, retry_delay
+
+# ---------- Streaming chat completions ----------
+# Both generators yield plain text deltas as they arrive, so callers can
+# render progressively (st.write_stream) and join them for persistence.
+
+def stream_chat_v1(client, model, messages, temperature=0.7):
+    """openai>=1.0 client (OpenAI / DeepSeek via base_url)."""
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def stream_chat_legacy(model, messages, temperature=0.7, **kwargs):
+    """openai==0.28 module-level ChatCompletion API."""
+    import openai
+
+    stream = openai.ChatCompletion.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        **kwargs,
+    )
+    for chunk in stream:
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+class GuardedStream:
+    """
+    Iterates the text deltas, turning a failure mid-stream into a final error
+    chunk instead of an exception. The failure is also kept in .error, since
+    the joined text ("partial verdict❌ ...") no longer looks like an error.
+    """
+
+    def __init__(self, chunks, error_prefix="❌ AI Error", error=None):
+        self.chunks = chunks
+        self.error_prefix = error_prefix
+        self.error = error
+
+    def __iter__(self):
+        if self.error:  # failed before streaming started
+            yield self.error
+            return
+        try:
+            yield from self.chunks
+        except Exception as e:
+            self.error = f"{self.error_prefix}: {e}"
+            yield self.error
+
+
+# ---------- Backends ----------
+# Every backend exposes the same two calls:
+#   complete(messages, json_mode=False) -> str
+#   stream(messages)   -> iterator of text deltas
+# so analyze_conflict does not care whether it talks to OpenAI, DeepSeek or
+# the offline stub. Both go through the provider's shared rate limiter and
+# are retried with jittered backoff on 429/5xx and connection errors (a stream
+# only until its first chunk has been handed out). Calls that still fail feed
+# the provider's circuit breaker, which makes later calls fail fast while open.
+
+BACKENDS = {
+    "openai": {
+        "base_url": "https://api.openai.com/v1",
+        "model": "gpt-4o",
+        "key_env": "OPENAI_API_KEY",
+        "timeout": 60.0,
+        "max_retries": 2,
+        "supports_json": True,  # response_format={"type": "json_object"}
+        "rate_per_s": 8.0,
+        "burst": 16,
+        "max_inflight": 32,
+    },
+    "deepseek": {
+        "base_url": "https://api.deepseek.com/v1",
+        "model": "deepseek-chat",
+        "key_env": "DEEPSEEK_API_KEY",
+        "timeout": 90.0,
+        "max_retries": 2,
+        "supports_json": True,
+        "rate_per_s": 5.0,
+        "burst": 10,
+        "max_inflight": 24,
+    },
+}
+
+
+class LLMBackend:
+    name = "base"
+
+    def __init__(self, model, temperature=0.7, timeout=60.0, max_retries=2, limiter=None, supports_json=False):
+        self.model = model
+        self.temperature = temperature
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter
+        self.supports_json = supports_json
+
+    def _slot(self):
+        return self.limiter.slot() if self.limiter else nullcontext()
+
+    def _backoff(self, attempt, exc):
+        incr("llm_retries_total", stage=self.name)
+        time.sleep(retry_delay(attempt, exc))
+
+    def complete(self, messages, json_mode=False) -> str:
+        """json_mode asks for a JSON object where the provider supports it (ignored otherwise)."""
+        json_mode = json_mode and self.supports_json
+        breaker = breaker_for(self.name)
+        breaker.check()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slot():
+                    text = self._complete(messages, json_mode)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    breaker.failure(e)
+                    raise
+                self._backoff(attempt, e)
+            else:
+                breaker.success()
+                return text
+
+    def stream(self, messages):
+        breaker = breaker_for(self.name)
+        breaker.check()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                with self._slot():  # held until the stream is exhausted or closed
+                    for chunk in self._stream(messages):
+                        if not started:
+                            started = True
+                            breaker.success()
+                        yield chunk
+                return
+            except Exception as e:
+                if started or attempt == self.max_retries or not is_retryable(e):
+                    breaker.failure(e)
+                    raise
+                self._backoff(attempt, e)
+
+    def _complete(self, messages, json_mode=False) -> str:
+        return "".join(self._stream(messages))
+
+    def _stream(self, messages):
+        raise NotImplementedError
+
+
+class OpenAICompatBackend(LLMBackend):
+    """openai>=1.0 client. Holds one httpx connection pool for its lifetime."""
+
+    def __init__(self, name, api_key, base_url, model, **kwargs):
+        super().__init__(model, **kwargs)
+        from openai import OpenAI
+
+        self.name = name
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=self.timeout,
+            max_retries=0,  # retried by LLMBackend, through the rate limiter
+        )
+
+    def _complete(self, messages, json_mode=False) -> str:
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            **extra,
+        )
+        return response.choices[0].message.content
+
+    def _stream(self, messages):
+        return stream_chat_v1(self.client, self.model, messages, self.temperature)
+
+
+class LegacyOpenAIBackend(LLMBackend):
+    """openai==0.28 module-level API (no client object)."""
+
+    def __init__(self, name, api_key, base_url, model, **kwargs):
+        super().__init__(model, **kwargs)
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def _complete(self, messages, json_mode=False) -> str:
+        import openai
+
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        response = openai.ChatCompletion.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            api_key=self.api_key,
+            api_base=self.base_url,
+            request_timeout=self.timeout,
+            **extra,
+        )
+        return response.choices[0].message.content
+
+    def _stream(self, messages):
+        return stream_chat_legacy(
+            self.model, messages, self.temperature,
+            api_key=self.api_key, api_base=self.base_url, request_timeout=self.timeout,
+        )
+
+
+class StubBackend(LLMBackend):
+    """Offline backend for tests and benchmarks: canned verdict, configurable latency."""
+
+    name = "stub"
+
+    def __init__(self, model="stub", first_token_s=None, token_s=None, **kwargs):
+        kwargs.setdefault("supports_json", True)
+        super().__init__(model, **kwargs)
+        self.first_token_s = float(os.getenv("STUB_FIRST_TOKEN_S", "0.2") if first_token_s is None else first_token_s)
+        self.token_s = float(os.getenv("STUB_TOKEN_S", "0.01") if token_s is None else token_s)
+
+    def _verdict(self, messages) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        return (
+            "JudgeBot (stub) has reviewed both sides. "
+            f"The dispute text was {len(prompt)} characters long. "
+            "Both parties raise fair points, but the first is slightly more reasonable. "
+            "Win percentage: 55% vs 45%."
+        )
+
+    def _complete(self, messages, json_mode=False) -> str:
+        if not json_mode:
+            return super()._complete(messages)
+        time.sleep(self.first_token_s)
+        return json.dumps({
+            "verdict": self._verdict(messages),
+            "winner": "user1",
+            "user1_pct": 55,
+            "user2_pct": 45,
+            "key_arguments": {"user1": ["Raised the issue first"], "user2": ["Had a reasonable excuse"]},
+        })
+
+    def _stream(self, messages):
+        time.sleep(self.first_token_s)
+        for i, word in enumerate(self._verdict(messages).split(" ")):
+            if i:
+                time.sleep(self.token_s)
+            yield word if i == 0 else " " + word
+
+
+# ---------- Hedged requests ----------
+# HedgedBackend wraps a primary and a secondary provider. If the primary has
+# produced nothing within the hedge delay, the same request also goes to the
+# secondary. The delay is LLM_HEDGE_AFTER_S, or else the primary's recent p95
+# time to first token. Whichever answers first is used and the other is
+# cancelled. A primary that fails, or whose circuit breaker is open, hands
+# over to the secondary at once. A sync client cannot abort a request that is
+# still waiting for its first byte, so a losing request is closed when its
+# first chunk arrives, which also frees its rate-limiter slot.
+
+HEDGE_AFTER_S = os.getenv("LLM_HEDGE_AFTER_S")  # fixed delay; default: the primary's observed p95
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_S = {"stream": 3.0, "complete": 20.0}  # until HEDGE_MIN_SAMPLES have been seen
+HEDGE_MIN_S = 0.25
+HEDGE_MIN_SAMPLES = 20
+
+_first_token = {}  # (backend name, "stream" | "complete") -> recent seconds to first output
+_first_token_lock = threading.Lock()
+
+
+def record_first_token(name: str, kind: str, seconds: float):
+    with _first_token_lock:
+        samples = _first_token.get((name, kind))
+        if samples is None:
+            samples = _first_token[(name, kind)] = deque(maxlen=200)
+        samples.append(seconds)
+
+
+def first_token_percentile(name: str, kind: str, pct: float = HEDGE_PERCENTILE) -> float | None:
+    with _first_token_lock:
+        samples = sorted(_first_token.get((name, kind)) or ())
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class HedgedBackend(LLMBackend):
+    def __init__(self, primary: LLMBackend, secondary: LLMBackend, hedge_after_s: float | None = None):
+        # model/temperature are the primary's: they key the verdict cache
+        super().__init__(primary.model, primary.temperature, primary.timeout, max_retries=0,
+                         supports_json=primary.supports_json)
+        self.name = f"{primary.name}+{secondary.name}"
+        self.backends = (primary, secondary)
+        if hedge_after_s is None and HEDGE_AFTER_S:
+            hedge_after_s = float(HEDGE_AFTER_S)
+        self.hedge_after_s = hedge_after_s
+
+    def hedge_delay(self, backend: LLMBackend, kind: str) -> float:
+        if self.hedge_after_s is not None:
+            return self.hedge_after_s
+        p = first_token_percentile(backend.name, kind)
+        return HEDGE_DEFAULT_S[kind] if p is None else max(HEDGE_MIN_S, p)
+
+    def complete(self, messages, json_mode=False) -> str:
+        return "".join(self._race("complete", lambda b: iter([b.complete(messages, json_mode)])))
+
+    def stream(self, messages):
+        return self._race("stream", lambda b: b.stream(messages))
+
+    def _pump(self, i, kind, call, events, cancel):
+        backend = self.backends[i]
+        started = time.perf_counter()
+        chunks = None
+        try:
+            chunks = call(backend)
+            for n, chunk in enumerate(chunks):
+                if n == 0:
+                    record_first_token(backend.name, kind, time.perf_counter() - started)
+                if cancel.is_set():
+                    incr("llm_hedge_cancelled_total", stage=backend.name)
+                    return
+                events.put((i, "chunk", chunk))
+            events.put((i, "done", None))
+        except Exception as e:
+            events.put((i, "error", e))
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    def _race(self, kind, call):
+        events = queue.Queue()
+        # a provider whose breaker is open goes last
+        order = sorted(range(len(self.backends)), key=lambda i: breaker_for(self.backends[i].name).is_open())
+        running = []  # (backend index, cancel event)
+
+        def launch():
+            i, cancel = order[len(running)], threading.Event()
+            running.append((i, cancel))
+            threading.Thread(target=self._pump, args=(i, kind, call, events, cancel),
+                             name=f"llm-{self.backends[i].name}", daemon=True).start()
+
+        launch()
+        deadline = time.monotonic() + self.hedge_delay(self.backends[order[0]], kind)
+        errors = []
+        try:
+            while True:
+                spare = len(running) < len(order)
+                try:
+                    i, event, value = events.get(timeout=max(0.0, deadline - time.monotonic()) if spare else None)
+                except queue.Empty:
+                    incr("llm_hedges_total", stage=kind)
+                    launch()
+                    continue
+                if event != "error":
+                    break
+                errors.append(value)
+                if spare:
+                    incr("llm_fallbacks_total", stage=kind)
+                    launch()
+                elif len(errors) == len(running):
+                    raise errors[0]
+
+            winner = i
+            for j, cancel in running:
+                if j != winner:
+                    cancel.set()
+            if len(running) > 1:
+                incr("llm_hedge_wins_total", stage=self.backends[winner].name)
+            while True:
+                if i == winner:
+                    if event == "done":
+                        return
+                    if event == "error":
+                        raise value
+                    yield value
+                i, event, value = events.get()
+        finally:
+            for _, cancel in running:
+                cancel.set()
+
+
+def _openai_major() -> int:
+    """Major version of the installed openai package (0 if it is missing), without importing it."""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return int(version("openai").split(".")[0])
+    except (PackageNotFoundError, ValueError):
+        return 0
+
+
+def make_backend(name: str, api_key: str | None = None, hedge: str | None = None, **overrides) -> LLMBackend:
+    """
+    Build a backend by name ("openai", "deepseek", "stub"). LLM_BACKEND in the
+    environment wins over `name`, so LLM_BACKEND=stub runs any app offline.
+    `hedge` (default: LLM_HEDGE) names a second provider to hedge and fall
+    back to; its key comes from its own environment variable.
+    """
+    name = os.getenv("LLM_BACKEND", name)
+    if name == "stub":
+        return StubBackend(**overrides)
+    hedge = os.getenv("LLM_HEDGE") if hedge is None else hedge
+    if hedge and hedge != name:
+        return HedgedBackend(_provider_backend(name, api_key, **overrides), _provider_backend(hedge))
+    return _provider_backend(name, api_key, **overrides)
+
+
+def _provider_backend(name: str, api_key: str | None = None, **overrides) -> LLMBackend:
+    """One provider's backend; the names are already resolved (no LLM_BACKEND / LLM_HEDGE here)."""
+    if name == "stub":
+        return StubBackend(**overrides)
+    conf = dict(BACKENDS[name])
+    conf.update(overrides)
+    key_env = conf.pop("key_env")
+    # Shared across sessions and processes; LLM_RATE_LIMIT=0 turns it off
+    rate = float(os.getenv("LLM_RATE_PER_S", conf.pop("rate_per_s")))
+    burst = int(os.getenv("LLM_BURST", conf.pop("burst")))
+    max_inflight = int(os.getenv("LLM_MAX_INFLIGHT", conf.pop("max_inflight")))
+    if os.getenv("LLM_RATE_LIMIT", "1") != "0":
+        conf.setdefault("limiter", limiter_for(name, rate, burst, max_inflight))
+    api_key = api_key or os.getenv(key_env)
+    cls = OpenAICompatBackend if _openai_major() >= 1 else LegacyOpenAIBackend
+    return cls(name, api_key, conf.pop("base_url"), conf.pop("model"), **conf)
@@ -0,0 +1,35 @@
+import os
+
+# ---------- Outgoing mail ----------
+# Only sign-in links are mailed by the server; everything else is sent by the
+# users themselves through mailto: and wa.me links. Configured from the
+# environment (Streamlit also exports top-level secrets there); without
+# SMTP_HOST nothing can be sent and enabled() is False.
+
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "10"))
+
+
+def enabled() -> bool:
+    return bool(SMTP_HOST and SMTP_FROM)
+
+
+def send_mail(to: str, subject: str, body: str):
+    # smtplib is only imported when mail is actually sent
+    import smtplib
+    from email.message import EmailMessage
+
+    msg = EmailMessage()
+    msg["From"], msg["To"], msg["Subject"] = SMTP_FROM, to, subject
+    msg.set_content(body)
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_S) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(msg)
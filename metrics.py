@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ---------- Hot-path metrics ----------
+# Stage timers feed in-process histograms and counters (a lock plus a few
+# additions per observation). They are exported in Prometheus text format from
+# an optional local endpoint (METRICS_PORT). Per-verdict Trace records go to
+# TIMINGS_DB as JSON lines for METRICS_SAMPLE_RATE of requests. Worker
+# processes started by an app snapshot their values into METRICS_DIR, and the
+# app's endpoint adds them to its own (see "Worker processes" below).
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "0.1"))
+METRICS_PORT = os.getenv("METRICS_PORT")
+TIMINGS_DB = os.getenv("TIMINGS_DB", "timings.jsonl")
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics.d")
+METRICS_SNAPSHOT_S = float(os.getenv("METRICS_SNAPSHOT_S", "5"))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> [bucket counts..., +Inf count, sum]
+_counters = {}    # (name, stage or "") -> value
+
+
+def observe(stage: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        h = _histograms.get(stage)
+        if h is None:
+            h = _histograms[stage] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+        h[len(BUCKETS)] += 1
+        h[-1] += seconds
+
+
+def incr(name: str, n: float = 1, stage: str = ""):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _counters[(name, stage)] = _counters.get((name, stage), 0) + n
+
+
+@contextmanager
+def timed(stage: str, trace=None):
+    """Time a block into the `stage` histogram (and `trace`, if given); count errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        incr("errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(stage, elapsed)
+        if trace is not None:
+            trace.mark(stage, elapsed)
+
+
+def timed_stream(chunks, stage: str = "llm", trace=None):
+    """Wrap a text-delta iterator: time to first token, total time, deltas (≈ tokens)."""
+    start = time.perf_counter()
+    first = None
+    count = 0
+    try:
+        for chunk in chunks:
+            if first is None:
+                first = time.perf_counter() - start
+                observe(f"{stage}_first_token", first)
+                if trace is not None:
+                    trace.mark(f"{stage}_first_token", first)
+            count += 1
+            yield chunk
+    except Exception:
+        incr("errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(stage, elapsed)
+        incr("llm_stream_tokens_total", count)
+        if trace is not None:
+            trace.mark(stage, elapsed)
+
+
+# ---------- Per-request traces ----------
+class Trace:
+    """Stage durations for one verdict; emitted as one JSON line when sampled."""
+
+    def __init__(self, **labels):
+        self.sampled = METRICS_ENABLED and random.random() < METRICS_SAMPLE_RATE
+        self.labels = labels
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def mark(self, stage: str, seconds: float):
+        self.stages[stage] = round(seconds * 1000, 3)
+
+    def stage(self, name: str):
+        return timed(name, self)
+
+    def emit(self, path: str = TIMINGS_DB):
+        if not self.sampled:
+            return
+        from write_behind import jsonl_writer  # lazy: avoids a cycle at import time
+
+        record = {
+            "timestamp": datetime.utcnow().isoformat(),
+            **self.labels,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages_ms": self.stages,
+        }
+        jsonl_writer(path).put(record)
+
+
+# ---------- Worker processes ----------
+# A child process (verdict worker) writes its histograms and counters to
+# METRICS_DIR/<parent pid>-<pid>.json every METRICS_SNAPSHOT_S. The parent's
+# endpoint sums its own values with its children's snapshots, so one scrape
+# covers the app and the workers it started; a dead worker's last snapshot is
+# kept, so totals never go backwards. Snapshots of parents that are gone are
+# removed. Values are at most METRICS_SNAPSHOT_S old.
+
+def _snapshot():
+    with _lock:
+        return {k: list(v) for k, v in _histograms.items()}, dict(_counters)
+
+
+def write_snapshot(parent_pid: int, directory: str = METRICS_DIR):
+    histograms, counters = _snapshot()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{parent_pid}-{os.getpid()}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"histograms": histograms, "counters": [[n, s, v] for (n, s), v in counters.items()]}, f)
+    os.replace(path + ".tmp", path)
+
+
+def start_snapshots(parent_pid: int, directory: str = METRICS_DIR, interval_s: float = METRICS_SNAPSHOT_S):
+    """Snapshot this process's metrics for `parent_pid`'s endpoint from a daemon thread."""
+    if not METRICS_ENABLED:
+        return
+
+    def loop():
+        while True:
+            try:
+                write_snapshot(parent_pid, directory)
+            except OSError as e:
+                log.warning("Metrics snapshot failed: %s", e)
+            time.sleep(interval_s)
+
+    threading.Thread(target=loop, name="metrics-snapshot", daemon=True).start()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _with_children(histograms: dict, counters: dict, directory: str = METRICS_DIR):
+    """Add the snapshots of this process's children; drop those of dead parents."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return histograms, counters
+    me = str(os.getpid())
+    for name in names:
+        parent, _, rest = name.partition("-")
+        if not rest.endswith(".json") or not parent.isdigit():
+            continue
+        path = os.path.join(directory, name)
+        if parent != me:
+            if not _alive(int(parent)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for stage, h in snap["histograms"].items():
+            mine = histograms.setdefault(stage, [0] * (len(BUCKETS) + 1) + [0.0])
+            histograms[stage] = [a + b for a, b in zip(mine, h)]
+        for n, s, v in snap["counters"]:
+            counters[(n, s)] = counters.get((n, s), 0) + v
+    return histograms, counters
+
+
+# ---------- Prometheus export ----------
+def render_prometheus() -> str:
+    lines = [
+        "# HELP fairfight_stage_seconds Time spent per pipeline stage.",
+        "# TYPE fairfight_stage_seconds histogram",
+    ]
+    histograms, counters = _with_children(*_snapshot())
+    for stage, h in sorted(histograms.items()):
+        for i, bound in enumerate(BUCKETS):
+            lines.append(f'fairfight_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {h[i]}')
+        lines.append(f'fairfight_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h[len(BUCKETS)]}')
+        lines.append(f'fairfight_stage_seconds_sum{{stage="{stage}"}} {h[-1]:.6f}')
+        lines.append(f'fairfight_stage_seconds_count{{stage="{stage}"}} {h[len(BUCKETS)]}')
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f"# TYPE fairfight_{name} counter")
+        for (n, stage), value in sorted(counters.items()):
+            if n != name:
+                continue
+            label = f'{{stage="{stage}"}}' if stage else ""
+            lines.append(f"fairfight_{name}{label} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _metrics_server(host: str, port: int):
+    # http.server is only imported when the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer((host, port), MetricsHandler)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host: str = "127.0.0.1"):
+    """Serve /metrics on a local port once per process (no-op when port is unset or taken)."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = _metrics_server(host, int(port))
+            except OSError as e:  # another replica on this host owns the port
+                log.warning("Metrics endpoint not started: %s", e)
+                _server = False  # don't retry on every rerun
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server or None
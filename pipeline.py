@@ -0,0 +1,21 @@
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------- Shared worker pool for the Step-2 pipeline ----------
+# One pool per process (imported modules survive Streamlit reruns). Work
+# submitted here must not call st.* — Streamlit only renders from the script
+# thread — so tasks return values and the page renders them when ready.
+
+MAX_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="pipeline")
+
+
+def submit(fn, *args, **kwargs):
+    return _pool.submit(fn, *args, **kwargs)
+
+
+def preload_modules(*names):
+    """Import heavy modules on the pool; a later import just waits for (or reuses) the result."""
+    return [_pool.submit(importlib.import_module, name) for name in names]
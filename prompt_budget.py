@@ -0,0 +1,125 @@
+import functools
+import math
+import os
+import re
+from collections import Counter
+
+from metrics import incr
+
+# ---------- Prompt budget ----------
+# Both sides of the story go to the model inside one token budget. Sides that
+# fit their fair share are sent verbatim; a longer side gets whatever the
+# other leaves unused, and if it is still over it is condensed extractively:
+# the highest-scoring sentences (frequent content words, opening and closing
+# sentences favoured, repeats dropped) are kept in their original order with
+# "…" where text was cut. No model call is involved. Only the prompt changes;
+# callers keep storing the original texts.
+
+PROMPT_INPUT_TOKENS = int(os.getenv("PROMPT_INPUT_TOKENS", "6000"))  # both sides together; 0 disables
+ELISION = " … "
+
+# Without tiktoken: ~1 token per CJK/kana/hangul character, per 4 characters of
+# other words and per punctuation mark, which is close to the BPE counts.
+_PIECE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w{1,4}|[^\w\s]")
+_SENTENCE = re.compile(r"[^.!?。！？\n]+(?:[.!?。！？]+|\n+|$)")
+_WORD = re.compile(r"\w{4,}")
+
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # the BPE file could not be loaded (offline)
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text or "", disallowed_special=()))
+    return len(_PIECE.findall(text or ""))
+
+
+def truncate_tokens(text: str, limit: int, model: str = "gpt-4o") -> str:
+    enc = _encoding(model)
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return text if len(ids) <= limit else enc.decode(ids[:limit])
+    pieces = list(_PIECE.finditer(text))
+    return text if len(pieces) <= limit else text[:pieces[limit].start()] if limit > 0 else ""
+
+
+def allocate(counts: list[int], budget: int) -> list[int]:
+    """Max-min fair shares: a side under its equal share keeps all of it, the rest is split among the others."""
+    shares = [0] * len(counts)
+    remaining = budget
+    order = sorted(range(len(counts)), key=counts.__getitem__)
+    for i, idx in enumerate(order):
+        shares[idx] = min(counts[idx], remaining // (len(order) - i))
+        remaining -= shares[idx]
+    return shares
+
+
+def condense(text: str, limit: int, model: str = "gpt-4o") -> str:
+    """An extract of `text` that fits in `limit` tokens."""
+    sentences = [s.strip() for s in _SENTENCE.findall(text) if s.strip()]
+    freq = Counter(w for w in _WORD.findall(text.casefold()))
+    last = len(sentences) - 1
+
+    def score(i, sentence):
+        words = set(_WORD.findall(sentence.casefold()))
+        value = sum(math.log1p(freq[w]) for w in words) / math.sqrt(len(words) + 1)
+        return value * (1.5 if i in (0, 1, last) else 1.0)
+
+    ranked = sorted(range(len(sentences)), key=lambda i: score(i, sentences[i]), reverse=True)
+    chosen, seen, used = [], set(), 0
+    elision = count_tokens(ELISION, model)
+    for i in ranked:
+        normalized = " ".join(_WORD.findall(sentences[i].casefold()))
+        cost = count_tokens(sentences[i], model) + elision
+        if normalized in seen or used + cost > limit:
+            continue
+        seen.add(normalized)
+        chosen.append(i)
+        used += cost
+    if not chosen:  # not even one sentence fits: keep the beginning
+        return truncate_tokens(text, max(limit - elision, 0), model).rstrip() + ELISION.rstrip()
+
+    parts, prev = [], -1
+    for i in sorted(chosen):
+        if parts and i != prev + 1:
+            parts.append(ELISION.strip())
+        parts.append(sentences[i])
+        prev = i
+    if prev != last:
+        parts.append(ELISION.strip())
+    return " ".join(parts)
+
+
+def fit_inputs(texts: list[str], budget: int = PROMPT_INPUT_TOKENS, model: str = "gpt-4o"):
+    """(texts to send, report) where report has tokens_in, tokens_out, saved and condensed per side."""
+    counts = [count_tokens(t, model) for t in texts]
+    report = {"tokens_in": sum(counts), "tokens_out": sum(counts), "saved": 0, "condensed": [False] * len(texts)}
+    if budget <= 0 or sum(counts) <= budget:
+        incr("prompt_tokens_total", report["tokens_out"])
+        return list(texts), report
+
+    fitted = []
+    for i, (text, count, share) in enumerate(zip(texts, counts, allocate(counts, budget))):
+        if count > share:
+            text = condense(text, share, model)
+            report["condensed"][i] = True
+            incr("prompt_inputs_condensed_total")
+        fitted.append(text)
+    report["tokens_out"] = sum(count_tokens(t, model) for t in fitted)
+    report["saved"] = report["tokens_in"] - report["tokens_out"]
+    incr("prompt_tokens_total", report["tokens_out"])
+    incr("prompt_tokens_saved_total", report["saved"])
+    return fitted, report
@@ -0,0 +1,232 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics import incr, observe
+
+# ---------- Outbound LLM rate limiting ----------
+# One token bucket (requests per second with a burst allowance) plus a cap on
+# requests in flight, per provider, shared by every session, process and
+# replica that can see RATE_LIMIT_DB. State lives in a small SQLite file and
+# each acquire is one short IMMEDIATE transaction. In-flight slots expire
+# after SLOT_TTL_S so a crashed process cannot leak capacity.
+
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "rate_limit.sqlite3")
+RATE_LIMIT_WAIT_S = float(os.getenv("RATE_LIMIT_WAIT_S", "60"))
+SLOT_TTL_S = float(os.getenv("RATE_LIMIT_SLOT_TTL_S", "600"))
+POLL_S = 0.05
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS slots (id TEXT PRIMARY KEY, name TEXT NOT NULL, expires REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS slots_name ON slots (name);
+"""
+
+
+class RateLimited(RuntimeError):
+    pass
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate_per_s: float, burst: int, max_inflight: int, path: str = RATE_LIMIT_DB):
+        self.name = name
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def try_acquire(self) -> tuple[str | None, float]:
+        """(slot id, 0) when admitted, else (None, seconds worth waiting)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+                (inflight,) = conn.execute("SELECT COUNT(*) FROM slots WHERE name = ?", (self.name,)).fetchone()
+                if inflight >= self.max_inflight:
+                    conn.execute("COMMIT")
+                    return None, POLL_S
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate_per_s)
+                slot = None
+                if tokens >= 1:
+                    tokens -= 1
+                    slot = uuid.uuid4().hex
+                    conn.execute("INSERT INTO slots (id, name, expires) VALUES (?, ?, ?)",
+                                 (slot, self.name, now + SLOT_TTL_S))
+                conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                             (self.name, tokens, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return slot, 0.0 if slot else (1 - tokens) / self.rate_per_s
+
+    def acquire(self, timeout: float = RATE_LIMIT_WAIT_S) -> str:
+        start = time.monotonic()
+        while True:
+            slot, wait = self.try_acquire()
+            if slot:
+                waited = time.monotonic() - start
+                if waited > 0.001:
+                    incr("rate_limit_waits_total", stage=self.name)
+                observe("rate_limit_wait", waited)
+                return slot
+            if time.monotonic() - start + wait > timeout:
+                incr("rate_limit_rejections_total", stage=self.name)
+                raise RateLimited(f"{self.name} is busy, try again shortly")
+            # jitter keeps waiting processes from retrying in lockstep
+            time.sleep(wait + random.uniform(0, POLL_S))
+
+    def release(self, slot: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM slots WHERE id = ?", (slot,))
+        finally:
+            conn.close()
+
+    @contextmanager
+    def slot(self, timeout: float = RATE_LIMIT_WAIT_S):
+        slot = self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(name: str, rate_per_s: float, burst: int, max_inflight: int) -> RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = RateLimiter(name, rate_per_s, burst, max_inflight)
+        return limiter
+
+
+# ---------- Retries ----------
+RETRY_STATUSES = {408, 409, 429}
+RETRY_ERRORS = {"APIConnectionError", "APITimeoutError", "Timeout", "ServiceUnavailableError", "TryAgain"}
+
+
+def status_of(exc) -> int | None:
+    # openai>=1.0 errors carry .status_code, openai==0.28 errors .http_status
+    return getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+
+
+def is_retryable(exc) -> bool:
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRY_STATUSES or status >= 500
+    return type(exc).__name__ in RETRY_ERRORS
+
+
+def retry_delay(attempt: int, exc=None, base: float = 0.5, cap: float = 20.0) -> float:
+    """Full-jitter exponential backoff; a server Retry-After wins when present."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = None
+    if retry_after is not None:
+        return min(cap, retry_after)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+# ---------- Circuit breakers ----------
+# Per provider and per process. After BREAKER_FAILURES consecutive transient
+# failures (the same errors that are retried) calls fail fast for
+# BREAKER_RESET_S; then a single trial call is let through, and its outcome
+# closes the breaker or opens it again. Client errors (4xx) do not count.
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_s: float = BREAKER_RESET_S):
+        self.name = name
+        self.failures = failures
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened_at = None
+        self._trial_at = None
+
+    def is_open(self) -> bool:
+        """True while calls would be refused (does not use up the half-open trial)."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_s:
+                return True
+            return self._trial_at is not None and now - self._trial_at < self.reset_s
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_s:
+                return False
+            if self._trial_at is not None and now - self._trial_at < self.reset_s:
+                return False  # a trial call is already out
+            self._trial_at = now
+            return True
+
+    def check(self):
+        if not self.allow():
+            incr("llm_circuit_rejected_total", stage=self.name)
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open), try again shortly")
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                incr("llm_circuit_closed_total", stage=self.name)
+            self._count = 0
+            self._opened_at = self._trial_at = None
+
+    def failure(self, exc=None):
+        if exc is not None and not is_retryable(exc):
+            return
+        with self._lock:
+            self._count += 1
+            self._trial_at = None
+            if self._count >= self.failures or self._opened_at is not None:
+                if self._opened_at is None:
+                    incr("llm_circuit_opened_total", stage=self.name)
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from metrics import incr
+
+# ---------- System-prompt translation cache ----------
+# The JudgeBot instruction is a constant, so its translation only depends on
+# (template, language). We keep those in memory, persist them to
+# TRANSLATIONS_DB so restarts are warm, and never let a slow translator hold
+# up a verdict: after TRANSLATE_TIMEOUT_S the English text is used and the
+# translation finishes in the background for the next request.
+
+TRANSLATIONS_DB = os.getenv("TRANSLATIONS_DB", "translations.json")
+TRANSLATE_TIMEOUT_S = float(os.getenv("TRANSLATE_TIMEOUT_S", "1.5"))
+
+log = logging.getLogger(__name__)
+
+# ✅ Map language codes to full names for clarity in prompts
+LANG_NAME_MAP = {
+    "en": "English", "fr": "French", "es": "Spanish", "de": "German", "ar": "Arabic",
+    "hi": "Hindi", "zh-cn": "Chinese", "pt": "Portuguese", "ru": "Russian"
+}
+
+_cache = {}          # "<template sha1>:<lang>" -> translated text
+_inflight = {}       # same key -> Future
+_lock = threading.Lock()
+_loaded = False
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="translate")
+
+
+def _key(template: str, lang: str) -> str:
+    return hashlib.sha1(template.encode("utf-8")).hexdigest() + ":" + lang
+
+
+def _google_code(lang: str) -> str:
+    # langdetect says "zh-cn", GoogleTranslator wants "zh-CN"
+    if lang.startswith("zh-"):
+        return "zh-" + lang[3:].upper()
+    return lang
+
+
+def _load():
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        _loaded = True
+        try:
+            with open(TRANSLATIONS_DB, "r", encoding="utf-8") as f:
+                _cache.update(json.load(f))
+        except Exception:
+            pass
+
+
+def _persist():
+    with _lock:
+        snapshot = dict(_cache)
+    try:
+        directory = os.path.dirname(os.path.abspath(TRANSLATIONS_DB))
+        fd, tmp = tempfile.mkstemp(prefix=".translations-", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, TRANSLATIONS_DB)
+    except Exception as e:
+        log.warning("Error saving translations: %s", e)
+
+
+def _translate_now(template: str, lang: str, key: str) -> str:
+    from deep_translator import GoogleTranslator
+
+    try:
+        text = GoogleTranslator(source="en", target=_google_code(lang)).translate(template)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    if text:
+        with _lock:
+            _cache[key] = text
+        _persist()
+    return text or template
+
+
+def _submit(template: str, lang: str):
+    key = _key(template, lang)
+    with _lock:
+        fut = _inflight.get(key)
+        if fut is None:
+            fut = _inflight[key] = _pool.submit(_translate_now, template, lang, key)
+    return fut
+
+
+def translate_instruction(template: str, lang: str, timeout: float = TRANSLATE_TIMEOUT_S) -> str:
+    """Translated template, or the English template if translation is slow or fails."""
+    if not lang or lang == "en":
+        return template
+    _load()
+    key = _key(template, lang)
+    with _lock:
+        hit = _cache.get(key)
+    if hit:
+        incr("translation_cache_hits_total")
+        return hit
+    incr("translation_cache_misses_total")
+    try:
+        return _submit(template, lang).result(timeout=timeout)
+    except TimeoutError:
+        incr("translation_fallbacks_total")
+        return template  # keeps translating in the background
+    except Exception:
+        incr("errors_total", stage="translate")
+        return template
+
+
+def prewarm(template: str, langs=None):
+    """Fill the cache for every known language without blocking the caller."""
+    _load()
+    for lang in langs or LANG_NAME_MAP:
+        if lang == "en":
+            continue
+        with _lock:
+            if _key(template, lang) in _cache:
+                continue
+        _submit(template, lang)
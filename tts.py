@@ -0,0 +1,150 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import incr, timed
+
+# ---------- Text to speech ----------
+# Long verdicts are split at sentence boundaries and the chunks are
+# synthesized in parallel; MP3 frames concatenate cleanly, so the pieces are
+# simply joined. Every chunk is cached on disk by (text hash, lang) in a
+# size-bounded directory with LRU eviction (mtime is bumped on every hit).
+# Audio is returned as bytes, so st.audio never needs a temp file.
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+CHUNK_CHARS = 400
+_TMP_PREFIX = ".tts-"
+
+log = logging.getLogger(__name__)
+
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("TTS_WORKERS", "6")), thread_name_prefix="tts")
+_cache_lock = threading.Lock()
+_cache_bytes = None  # lazily computed size of TTS_CACHE_DIR
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？؟।])\s+|\n+")
+
+
+# ---------- Chunking ----------
+def split_sentences(text: str, max_chars: int = CHUNK_CHARS) -> list[str]:
+    """Group sentences into chunks of at most max_chars (a single longer sentence is split on spaces)."""
+    chunks, current = [], ""
+    for sentence in _SENTENCE_END.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# ---------- Disk cache ----------
+def _cache_path(text: str, lang: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, f"{digest}-{lang}.mp3")
+
+
+def _cache_get(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # mark as recently used
+        return data
+    except OSError:
+        return None
+
+
+def _dir_entries():
+    """Cached files; other threads' in-flight temp files are not ours to count or evict."""
+    entries = []
+    for name in os.listdir(TTS_CACHE_DIR):
+        if name.startswith(_TMP_PREFIX):
+            continue
+        full = os.path.join(TTS_CACHE_DIR, name)
+        try:
+            info = os.stat(full)
+        except OSError:
+            continue
+        entries.append((info.st_mtime, info.st_size, full))
+    return entries
+
+
+def _cache_put(path: str, data: bytes):
+    global _cache_bytes
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=_TMP_PREFIX, dir=TTS_CACHE_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _dir_entries())
+        else:
+            _cache_bytes += len(data)
+        if _cache_bytes <= TTS_CACHE_MAX_BYTES:
+            return
+        # Evict least recently used files down to 90% of the budget
+        entries = sorted(_dir_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in entries:
+            if total <= TTS_CACHE_MAX_BYTES * 0.9:
+                break
+            try:
+                os.remove(full)
+                total -= size
+            except OSError:
+                pass
+        _cache_bytes = total
+
+
+# ---------- Synthesis ----------
+def _synthesize_chunk(text: str, lang: str) -> bytes:
+    path = _cache_path(text, lang)
+    cached = _cache_get(path)
+    if cached is not None:
+        incr("tts_cache_hits_total")
+        return cached
+    incr("tts_cache_misses_total")
+
+    from gtts import gTTS
+
+    buf = io.BytesIO()
+    gTTS(text=text, lang=lang).write_to_fp(buf)
+    data = buf.getvalue()
+    try:
+        _cache_put(path, data)
+    except OSError as e:
+        log.warning("Error caching speech: %s", e)
+    return data
+
+
+def synthesize(text: str, lang: str = "en") -> bytes:
+    """MP3 bytes for `text`, kept in memory so no temp files are left behind."""
+    lang = lang or "en"
+    chunks = split_sentences(text)
+    if not chunks:
+        return b""
+    with timed("tts"):
+        if len(chunks) == 1:
+            return _synthesize_chunk(chunks[0], lang)
+        parts = _pool.map(lambda chunk: _synthesize_chunk(chunk, lang), chunks)
+        return b"".join(parts)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from case_store import open_store
+from compaction import verdict_segments
+from verdict_parse import verdict_fields
+
+# ---------- Verdict cache ----------
+# Two tiers:
+#   1. a bounded in-process LRU (survives Streamlit reruns, lost on restart)
+#   2. the verdict log itself: save_verdict stores a "cache_key" on every
+#      record and case_store keeps a cache_key -> offset index for it, for the
+#      active log and for each dated segment rotation moved older verdicts to.
+# Error strings ("❌ ...") are never cached. The typed fields of a structured
+# verdict (winner, percentages, key arguments) are kept with the text, so a
+# structured repeat gets them back instead of a re-parse of the prose.
+
+MAX_MEMORY_ENTRIES = 512
+
+
+def _norm(value, fold=False) -> str:
+    text = unicodedata.normalize("NFC", str(value or ""))
+    text = " ".join(text.split())
+    return text.casefold() if fold else text
+
+
+def verdict_key(theme, user1_name, user2_name, user1_input, user2_input, model, temperature) -> str:
+    """Hash of the normalized dispute: whitespace/case noise does not change the key."""
+    parts = [
+        _norm(theme, fold=True),
+        _norm(user1_name, fold=True),
+        _norm(user2_name, fold=True),
+        _norm(user1_input),
+        _norm(user2_input),
+        str(model),
+        f"{float(temperature):.3f}",
+    ]
+    raw = json.dumps(parts, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def is_error(verdict) -> bool:
+    return not verdict or str(verdict).startswith("❌")
+
+
+def find_verdict(verdicts_path: str, key: str, value: str) -> dict | None:
+    """Newest non-error verdict record whose `key` field is `value`: active log first, then older segments."""
+    for path in reversed(verdict_segments(verdicts_path)):
+        try:
+            rec = open_store(path, key).get(value)
+        except Exception:
+            rec = None
+        if rec and not is_error(rec.get("verdict")):
+            return rec
+    return None
+
+
+class VerdictCache:
+    def __init__(self, verdicts_path: str, max_entries: int = MAX_MEMORY_ENTRIES):
+        self.verdicts_path = verdicts_path
+        self.max_entries = max_entries
+        self._lru = OrderedDict()   # key -> (verdict, lang, typed fields or None)
+        self._lock = threading.Lock()
+
+    def get(self, key: str, with_fields: bool = False):
+        """Return (verdict, lang) or None; with_fields: (verdict, lang, typed fields or None)."""
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                return hit if with_fields else hit[:2]
+        rec = find_verdict(self.verdicts_path, "cache_key", key)
+        if rec:
+            fields = verdict_fields(rec) if rec.get("key_arguments") is not None else None
+            hit = (rec["verdict"], rec.get("lang") or "en", fields)
+            self.remember(key, *hit)
+            return hit if with_fields else hit[:2]
+        return None
+
+    def remember(self, key: str, verdict: str, lang: str, fields: dict | None = None):
+        if not key or is_error(verdict):
+            return
+        with self._lock:
+            self._lru[key] = (verdict, lang, fields)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+
+def verdict_for_token(verdicts_path: str, token: str) -> dict | None:
+    """The verdict record already delivered for a case token, if any."""
+    if not token:
+        return None
+    return find_verdict(verdicts_path, "token", token)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(verdicts_path: str) -> VerdictCache:
+    with _caches_lock:
+        cache = _caches.get(verdicts_path)
+        if cache is None:
+            cache = _caches[verdicts_path] = VerdictCache(verdicts_path)
+        return cache
@@ -0,0 +1,301 @@
+"""
+Durable verdict job queue and its worker processes.
+
+    python -m verdict_jobs --backend deepseek --verdicts verdicts.jsonl --threads 4
+
+Step 2 enqueues (token, both sides of the story) and polls; workers claim
+jobs, run the judge, persist the verdict (which marks the case resolved) and
+record the result on the job row. The queue is a SQLite file in WAL mode, so
+it survives restarts and is shared by every replica on the volume. A claimed
+job holds a lease; if its worker dies the job is picked up again once the
+lease runs out. Finished and failed jobs are deleted after JOB_RETENTION_S
+(the verdict log keeps the verdicts). Workers started by an app snapshot
+their metrics for that app's /metrics endpoint.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import METRICS_DIR, incr, start_snapshots, timed
+
+JOBS_DB = os.getenv("JOBS_DB", "verdict_jobs.sqlite3")
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "0.5"))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(7 * 86400)))
+JOB_PRUNE_INTERVAL_S = float(os.getenv("JOB_PRUNE_INTERVAL_S", "3600"))
+# Worker processes started by each app process (0: run `python -m verdict_jobs` yourself)
+VERDICT_WORKERS = int(os.getenv("VERDICT_WORKERS", "2"))
+VERDICT_WORKER_THREADS = int(os.getenv("VERDICT_WORKER_THREADS", "4"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    token       TEXT PRIMARY KEY,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    not_before  REAL NOT NULL DEFAULT 0,  -- lease expiry (running) or retry time (queued)
+    verdict     TEXT,
+    lang        TEXT,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at);
+"""
+
+
+# ---------- Queue ----------
+class JobQueue:
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conn(self):
+        # A short-lived connection per call: safe across threads and forks
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _job(row) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def enqueue(self, token: str, payload: dict):
+        """Queue a case once; a failed job is re-queued, a live or finished one is left alone."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (token, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(token) DO UPDATE SET payload = excluded.payload, status = excluded.status, "
+                "attempts = 0, not_before = 0, error = NULL, updated_at = excluded.updated_at "
+                "WHERE jobs.status = ?",
+                (token, json.dumps(payload, ensure_ascii=False), QUEUED, now, now, FAILED),
+            )
+        incr("jobs_enqueued_total")
+
+    def claim(self, lease_s: float = JOB_LEASE_S) -> dict | None:
+        """Take the oldest runnable job (queued, or running with an expired lease)."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status IN (?, ?) AND not_before <= ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, not_before = ?, updated_at = ? "
+                        "WHERE token = ?",
+                        (RUNNING, now + lease_s, now, row["token"]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return self._job(row)
+
+    def complete(self, token: str, verdict: str, lang: str | None):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, verdict = ?, lang = ?, error = NULL, updated_at = ? WHERE token = ?",
+                (DONE, verdict, lang, time.time(), token),
+            )
+        incr("jobs_completed_total")
+
+    def retry(self, token: str, error: str, attempts: int, max_attempts: int = JOB_MAX_ATTEMPTS):
+        """Re-queue with exponential backoff, or mark failed after max_attempts."""
+        now = time.time()
+        status = FAILED if attempts >= max_attempts else QUEUED
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, not_before = ?, updated_at = ? WHERE token = ?",
+                (status, error, now + 2 ** attempts, now, token),
+            )
+        incr("jobs_failed_total" if status == FAILED else "jobs_retried_total")
+
+    def get(self, token: str) -> dict | None:
+        with self._conn() as conn:
+            return self._job(conn.execute("SELECT * FROM jobs WHERE token = ?", (token,)).fetchone())
+
+    def prune(self, older_than_s: float = JOB_RETENTION_S) -> int:
+        """Delete done and failed jobs last updated more than older_than_s ago."""
+        with self._conn() as conn:
+            deleted = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - older_than_s),
+            ).rowcount
+        incr("jobs_pruned_total", deleted)
+        return deleted
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def open_queue(path: str = JOBS_DB) -> JobQueue:
+    with _queues_lock:
+        queue = _queues.get(os.path.abspath(path))
+        if queue is None:
+            queue = _queues[os.path.abspath(path)] = JobQueue(path)
+        return queue
+
+
+# ---------- Worker ----------
+def process_job(judge, queue: JobQueue, job: dict, verdicts_path: str, to_postgres: bool = False):
+    from verdict_cache import is_error
+    from verdict_parse import verdict_fields
+    from write_behind import jsonl_writer, postgres_writer
+
+    p = job["payload"]
+    args = (p["user1_input"], p["user2_input"], p["theme"], p["user1_name"], p["user2_name"])
+    with timed("job"):
+        result = judge.analyze(*args, structured=True)
+    verdict, lang = result["verdict"], result["lang"]
+    if is_error(verdict):
+        queue.retry(job["token"], verdict, job["attempts"] + 1)
+        return
+
+    record = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "token": job["token"],
+        "theme": p["theme"],
+        "user1_name": p["user1_name"],
+        "user2_name": p["user2_name"],
+        "user1_input": p["user1_input"],
+        "user2_input": p["user2_input"],
+        "verdict": verdict,
+        "lang": lang,
+        "cache_key": judge.dispute_key(*args),
+        **verdict_fields(result),  # winner, percentages, key arguments
+    }
+    # The verdict line is what marks the case resolved, so it is on disk
+    # before the job is reported done.
+    writer = jsonl_writer(verdicts_path)
+    writer.put(record)
+    if to_postgres:
+        postgres_writer().put(record)
+    if not writer.flush(timeout=30):
+        # still queued in the writer (and retried there); judged again if it never lands
+        queue.retry(job["token"], "❌ Verdict could not be saved", job["attempts"] + 1)
+        return
+    queue.complete(job["token"], verdict, lang)
+
+
+def run_worker(backend: str, verdicts_path: str, jobs_path: str = JOBS_DB,
+               threads: int = VERDICT_WORKER_THREADS, to_postgres: bool = False, parent_pid: int | None = None):
+    from judge import Judge
+    from llm import make_backend
+
+    judge = Judge(make_backend(backend), verdicts_path)
+    queue = JobQueue(jobs_path)
+    if parent_pid is not None:
+        start_snapshots(parent_pid)  # served by the parent app's /metrics
+
+    def alive():
+        return parent_pid is None or os.getppid() == parent_pid
+
+    def prune():
+        while alive():
+            try:
+                queue.prune()
+            except sqlite3.Error as e:
+                log.warning("Verdict job prune failed: %s", e)
+            time.sleep(JOB_PRUNE_INTERVAL_S)
+
+    def loop():
+        while alive():
+            job = queue.claim()
+            if job is None:
+                time.sleep(JOB_POLL_S)
+                continue
+            try:
+                process_job(judge, queue, job, verdicts_path, to_postgres)
+            except Exception as e:
+                log.exception("Verdict job %s failed: %s", job["token"], e)
+                queue.retry(job["token"], f"❌ AI Error: {e}", job["attempts"] + 1)
+
+    workers = [threading.Thread(target=loop, name=f"verdict-worker-{i}", daemon=True) for i in range(threads)]
+    for t in workers:
+        t.start()
+    threading.Thread(target=prune, name="verdict-job-prune", daemon=True).start()
+    for t in workers:
+        t.join()
+
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def start_workers(backend: str, verdicts_path: str, jobs_path: str = JOBS_DB, api_key: str | None = None,
+                  to_postgres: bool = False, processes: int = VERDICT_WORKERS):
+    """Spawn worker processes once per app process; they exit when the app does."""
+    from llm import BACKENDS
+
+    key = (backend, os.path.abspath(jobs_path))
+    with _started_lock:
+        if key in _started or processes <= 0:
+            return
+        _started.add(key)
+
+    # Workers run in the app's working directory, so relative paths (rate
+    # limiter, translations, TTS cache, metrics) resolve to the same files;
+    # PYTHONPATH lets `-m verdict_jobs` find this module from there.
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, METRICS_DIR=os.path.abspath(METRICS_DIR),
+               PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    if api_key and backend in BACKENDS:
+        env[BACKENDS[backend]["key_env"]] = api_key
+    cmd = [
+        sys.executable, "-m", "verdict_jobs",
+        "--backend", backend,
+        "--verdicts", os.path.abspath(verdicts_path),
+        "--jobs", os.path.abspath(jobs_path),
+        "--parent-pid", str(os.getpid()),
+    ]
+    if to_postgres:
+        cmd.append("--postgres")
+    for _ in range(processes):
+        subprocess.Popen(cmd, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run verdict jobs from the durable queue")
+    parser.add_argument("--backend", default="deepseek")
+    parser.add_argument("--verdicts", default="verdicts.jsonl")
+    parser.add_argument("--jobs", default=JOBS_DB)
+    parser.add_argument("--threads", type=int, default=VERDICT_WORKER_THREADS)
+    parser.add_argument("--postgres", action="store_true", help="also persist verdicts to Postgres")
+    parser.add_argument("--parent-pid", type=int, default=None, help="exit when this process goes away")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    run_worker(args.backend, args.verdicts, args.jobs, args.threads, args.postgres, args.parent_pid)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import json
+import re
+
+# ---------- Win percentages from verdict text ----------
+# JudgeBot is asked for "a win percentage (e.g., 60% vs 40%)" and answers in
+# the users' language, so the pair is found by shape rather than by wording:
+# two percentages at most a short phrase apart ("60% vs 40%", "60 % pour Alex
+# contre 40 %", "Alex: 60%, Sam: 40%"). Pairs overlap, so in "100% sure.
+# Alex 60% - Sam 40%" both 100/60 and 60/40 are candidates. A pair summing to
+# ~100 wins, the last one in the text (the final verdict) first.
+
+_PCT = r"(?<![\d.,])(\d{1,3}(?:[.,]\d+)?)\s*[%٪％]"
+_PAIR = re.compile(r"(?=(" + _PCT + r"[^\d%٪％\n]{0,40}?" + _PCT + r"))")  # lookahead: every adjacent pair
+
+
+def parse_percentages(text: str, user1_name: str = None, user2_name: str = None) -> tuple[float, float] | None:
+    """(user1 %, user2 %) or None. Names, when given, fix the order if user 2 is named first."""
+    candidates = []
+    for m in _PAIR.finditer(text or ""):
+        a, b = (float(x.replace(",", ".")) for x in m.groups()[1:])
+        if a <= 100 and b <= 100:
+            candidates.append((m, a, b))
+    if not candidates:
+        return None
+    m, a, b = next((c for c in reversed(candidates) if abs(c[1] + c[2] - 100) <= 1), candidates[-1])
+
+    if user1_name and user2_name:
+        window = text[max(0, m.start() - 40):m.end(1)].casefold()
+        i1, i2 = window.find(user1_name.casefold()), window.find(user2_name.casefold())
+        if i1 >= 0 and i2 >= 0 and i2 < i1:
+            a, b = b, a
+    return a, b
+
+
+def winner_of(percentages) -> int:
+    """1 or 2 for the side with the higher share, 0 for a tie or no result."""
+    if not percentages:
+        return 0
+    a, b = percentages
+    return 1 if a > b else 2 if b > a else 0
+
+
+# ---------- Structured verdicts ----------
+# With a JSON-capable backend the judge is asked for STRUCTURED_INSTRUCTION's
+# object; parse_verdict() accepts that, JSON wrapped in prose or code fences,
+# or plain text (percentages by shape, no key arguments), and always returns
+# the same fields.
+
+STRUCTURED_INSTRUCTION = (
+    "Return only a JSON object with these keys: "
+    '"verdict" (your full explanation and decision, in the users\' language), '
+    '"winner" ("user1", "user2" or "tie"), '
+    '"user1_pct" and "user2_pct" (integer win percentages adding up to 100), '
+    '"key_arguments" (an object with "user1" and "user2" lists of short strings).'
+)
+
+FIELDS = ("winner", "user1_pct", "user2_pct", "key_arguments")
+
+
+def _json_object(text: str):
+    text = (text or "").strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _number(value):
+    try:
+        return float(str(value).strip().rstrip("%٪％").replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def _winner(value, user1_name=None, user2_name=None):
+    value = str(value or "").strip().casefold()
+    if not value:
+        return None
+    if value in ("user1", "1", (user1_name or "").casefold()):
+        return 1
+    if value in ("user2", "2", (user2_name or "").casefold()):
+        return 2
+    if value in ("tie", "draw", "0"):
+        return 0
+    return None
+
+
+def _arguments(value) -> dict:
+    value = value if isinstance(value, dict) else {}
+    return {side: [str(a) for a in value.get(side) or [] if a][:10] for side in ("user1", "user2")}
+
+
+def parse_verdict(text: str, user1_name: str = None, user2_name: str = None, lang: str = None) -> dict:
+    """{verdict, winner (1, 2, 0 for a tie, None if unknown), user1_pct, user2_pct, key_arguments, lang}."""
+    data = _json_object(text)
+    verdict = str(data.get("verdict") or "").strip() if data else ""
+    if verdict:
+        a, b = _number(data.get("user1_pct")), _number(data.get("user2_pct"))
+        pct = (a, b) if a is not None and b is not None else parse_percentages(verdict, user1_name, user2_name)
+        winner = _winner(data.get("winner"), user1_name, user2_name)
+        arguments = _arguments(data.get("key_arguments"))
+        if pct and parse_percentages(verdict) is None:
+            # keep the score visible in the text users read and hear
+            verdict += f"\n\n⚖️ {user1_name or 'User 1'} {pct[0]:g}% – {user2_name or 'User 2'} {pct[1]:g}%"
+    else:
+        verdict = text or ""
+        pct = parse_percentages(verdict, user1_name, user2_name)
+        winner = None
+        arguments = _arguments(None)
+    if winner is None and pct:
+        winner = winner_of(pct)
+    return {
+        "verdict": verdict,
+        "winner": winner,
+        "user1_pct": pct[0] if pct else None,
+        "user2_pct": pct[1] if pct else None,
+        "key_arguments": arguments,
+        "lang": lang,
+    }
+
+
+def verdict_fields(parsed: dict) -> dict:
+    """The typed columns stored next to the verdict text."""
+    return {k: parsed.get(k) for k in FIELDS}
@@ -0,0 +1,180 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from case_store import append_bytes, encode_record, file_lock
+from metrics import incr, timed
+
+# ---------- Write-behind persistence ----------
+# Verdict records are handed to a background thread and flushed in batches
+# (one write() for JSONL, one multi-row INSERT for Postgres) when either
+# WRITE_BATCH_SIZE records are waiting or WRITE_MAX_DELAY_S has passed since
+# the first one arrived. Pending records are flushed on interpreter exit.
+# A batch that still fails after FLUSH_RETRIES attempts is kept and retried
+# every WRITE_RETRY_S ahead of newer records; a flush() that sees a write
+# fail returns False, so callers do not treat those verdicts as saved.
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_MAX_DELAY_S = float(os.getenv("WRITE_MAX_DELAY_S", "0.5"))
+# "none": leave it to the OS, "batch": fsync every flush,
+# "interval": fsync at most once every FSYNC_INTERVAL_S
+JSONL_FSYNC = os.getenv("JSONL_FSYNC", "interval")
+FSYNC_INTERVAL_S = float(os.getenv("FSYNC_INTERVAL_S", "1.0"))
+FLUSH_RETRIES = 3
+WRITE_RETRY_S = float(os.getenv("WRITE_RETRY_S", "5.0"))
+
+_STOP = object()
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, name, flush_fn, batch_size=WRITE_BATCH_SIZE, max_delay_s=WRITE_MAX_DELAY_S):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.max_delay_s = max_delay_s
+        self._queue = queue.Queue()
+        self._idle = threading.Condition()
+        self._unflushed = 0
+        self._failed = []  # records whose last write failed (writer thread only)
+        self._failures = 0
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, record: dict):
+        with self._idle:
+            self._unflushed += 1
+        self._queue.put(record)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything put() so far has been written; False on timeout or a failed write meanwhile."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            failures = self._failures
+            while self._unflushed:
+                if self._failures != failures:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=WRITE_RETRY_S if self._failed else None)
+            except queue.Empty:
+                self._write([])  # nothing new: retry the failed records
+                continue
+            if first is _STOP:
+                if self._failed:
+                    self._write([])
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay_s
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        batch = self._failed + batch  # oldest first
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                # "jsonl:/path" -> persist_jsonl, "postgres:verdicts" -> persist_postgres
+                with timed("persist_" + self.name.split(":")[0]):
+                    self.flush_fn(batch)
+                incr("persisted_records_total", len(batch))
+                break
+            except Exception as e:
+                log.warning("Write-behind %s: flush of %d records failed (%s)", self.name, len(batch), e)
+                time.sleep(0.2 * (2 ** attempt))
+        else:
+            incr("write_behind_failures_total")
+            log.error("Write-behind %s: %d records not written, retrying in %ss", self.name, len(batch), WRITE_RETRY_S)
+            self._failed = batch
+            with self._idle:
+                self._failures += 1
+                self._idle.notify_all()
+            return
+        self._failed = []
+        with self._idle:
+            self._unflushed -= len(batch)
+            self._idle.notify_all()
+
+
+# ---------- Sinks ----------
+def jsonl_flusher(path: str, fsync_policy: str = JSONL_FSYNC):
+    last_sync = [0.0]
+
+    def flush(records):
+        data = b"".join(encode_record(r) for r in records)
+        sync = fsync_policy == "batch" or (
+            fsync_policy == "interval" and time.monotonic() - last_sync[0] >= FSYNC_INTERVAL_S
+        )
+        with file_lock(path):
+            append_bytes(path, data, fsync=sync)  # the whole batch in one O_APPEND write
+        if sync:
+            last_sync[0] = time.monotonic()
+
+    return flush
+
+
+def postgres_flusher():
+    def flush(records):
+        import db  # imported lazily: psycopg2 + pool are only needed when enabled
+
+        db.save_verdicts(records)
+
+    return flush
+
+
+# ---------- One writer per target per process ----------
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def open_writer(name: str, flush_fn) -> WriteBehindQueue:
+    with _writers_lock:
+        writer = _writers.get(name)
+        if writer is None:
+            writer = _writers[name] = WriteBehindQueue(name, flush_fn)
+        return writer
+
+
+def jsonl_writer(path: str) -> WriteBehindQueue:
+    return open_writer(f"jsonl:{os.path.abspath(path)}", jsonl_flusher(path))
+
+
+def postgres_writer() -> WriteBehindQueue:
+    return open_writer("postgres:verdicts", postgres_flusher())
+
+
+@atexit.register
+def _flush_all_on_exit():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+        if writer._failed:
+            log.error("Write-behind %s: %d records lost at exit", writer.name, len(writer._failed))